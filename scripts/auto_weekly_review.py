@@ -5,7 +5,12 @@
 """
 
 import os
+import re
+import subprocess
 import sys
+from collections import Counter
+from functools import lru_cache
+from itertools import chain
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -15,6 +20,9 @@ ARCHIVE_DIR = PROJECT_ROOT / "对话归档"
 THREADS_FILE = PROJECT_ROOT / "线头追踪" / "THREADS.md"
 REVIEW_DIR = PROJECT_ROOT / "复盘报告"
 
+TAG_RE = re.compile(r'#(\w+)')
+BULLET_CHARS = frozenset('-*12345')  # 洞见条目的开头字符
+
 def get_week_range():
     """获取上周的日期范围"""
     today = datetime.now()
@@ -28,55 +36,66 @@ def scan_archives(start_date, end_date):
     """扫描指定日期范围内的归档文件"""
     archives = []
 
-    # 遍历可能的月份目录
-    current = start_date
-    while current <= end_date:
-        month_dir = ARCHIVE_DIR / current.strftime("%Y-%m")
-        if month_dir.exists():
-            for f in month_dir.glob("*.md"):
+    # 一周最多跨两个月，直接定位对应的月份目录
+    months = {(start_date.year, start_date.month), (end_date.year, end_date.month)}
+    for year, month in sorted(months):
+        month_dir = ARCHIVE_DIR / f"{year}-{month:02d}"
+        if not month_dir.is_dir():
+            continue
+        with os.scandir(month_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.md'):
+                    continue
                 # 从文件名提取日期 (MMDD_xxx.md)
                 try:
-                    file_date_str = f.stem[:4]  # 取前4位 MMDD
-                    file_month = int(file_date_str[:2])
-                    file_day = int(file_date_str[2:4])
-                    file_date = datetime(current.year, file_month, file_day)
+                    file_date = datetime(year, int(entry.name[:2]), int(entry.name[2:4]))
 
                     if start_date <= file_date <= end_date:
+                        insights, tags = parse_archive_file(entry.path, entry.stat().st_mtime)
                         archives.append({
-                            'path': f,
+                            'path': Path(entry.path),
                             'date': file_date,
-                            'content': f.read_text(encoding='utf-8')
+                            'insights': insights,
+                            'tags': tags
                         })
                 except:
                     continue
-        current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
 
     return sorted(archives, key=lambda x: x['date'])
 
-def extract_insights(content):
-    """从归档内容中提取洞见"""
+def parse_archive(lines):
+    """逐行遍历归档内容，同时提取洞见和标签"""
     insights = []
+    tags = set()
     in_insights_section = False
+    insights_done = False
 
-    for line in content.split('\n'):
-        if '核心洞见' in line or '洞见' in line:
+    for line in lines:
+        tags.update(TAG_RE.findall(line))
+        if insights_done:
+            continue
+        if '洞见' in line:
             in_insights_section = True
             continue
         if in_insights_section:
             if line.startswith('#'):
-                break
-            if line.strip().startswith(('-', '*', '1', '2', '3', '4', '5')):
-                insight = line.strip().lstrip('-*0123456789. ')
+                insights_done = True
+                continue
+            stripped = line.strip()
+            if stripped[:1] in BULLET_CHARS:
+                insight = stripped.lstrip('-*0123456789. ')
                 if insight and len(insight) > 5:
                     insights.append(insight)
 
-    return insights[:5]  # 最多5条
+    return insights[:5], list(tags)  # 最多5条洞见
 
-def extract_tags(content):
-    """提取标签"""
-    import re
-    tags = re.findall(r'#(\w+)', content)
-    return list(set(tags))
+@lru_cache(maxsize=512)
+def parse_archive_file(path_str, mtime):
+    """解析单个归档文件，按 路径+修改时间 缓存（文件未变时不再读取）"""
+    # 边读边解析，只保留提取结果
+    with open(path_str, encoding='utf-8') as fp:
+        insights, tags = parse_archive(fp)
+    return tuple(insights), tuple(tags)
 
 def count_threads():
     """统计线头数量"""
@@ -94,21 +113,13 @@ def generate_review(start_date, end_date, archives):
     week_num = start_date.isocalendar()[1]
 
     # 统计数据
-    all_insights = []
-    all_tags = []
-    for a in archives:
-        all_insights.extend(extract_insights(a['content']))
-        all_tags.extend(extract_tags(a['content']))
-
-    # 标签统计
-    tag_counts = {}
-    for tag in all_tags:
-        tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    all_insights = list(chain.from_iterable(a['insights'] for a in archives))
+    tag_counts = Counter(chain.from_iterable(a['tags'] for a in archives))  # 标签统计
 
     threads = count_threads()
 
     # 生成报告
-    report = f"""# {start_date.year}年{start_date.month}月 第{week_num}周 AI对话复盘
+    parts = [f"""# {start_date.year}年{start_date.month}月 第{week_num}周 AI对话复盘
 
 **周期**：{start_date.strftime('%m.%d')} - {end_date.strftime('%m.%d')}
 **生成时间**：{datetime.now().strftime('%Y-%m-%d %H:%M')}
@@ -127,24 +138,22 @@ def generate_review(start_date, end_date, archives):
 
 ## 主题分布
 
-"""
+"""]
 
     if tag_counts:
-        report += "| 主题 | 对话数 |\n|------|--------|\n"
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1])[:10]:
-            report += f"| #{tag} | {count} |\n"
+        parts.append("| 主题 | 对话数 |\n|------|--------|\n")
+        parts.extend(f"| #{tag} | {count} |\n" for tag, count in tag_counts.most_common(10))
     else:
-        report += "*本周无标签数据*\n"
+        parts.append("*本周无标签数据*\n")
 
-    report += "\n---\n\n## 核心洞见汇总\n\n"
+    parts.append("\n---\n\n## 核心洞见汇总\n\n")
 
     if all_insights:
-        for i, insight in enumerate(all_insights[:10], 1):
-            report += f"{i}. {insight}\n"
+        parts.extend(f"{i}. {insight}\n" for i, insight in enumerate(all_insights[:10], 1))
     else:
-        report += "*本周无归档洞见*\n"
+        parts.append("*本周无归档洞见*\n")
 
-    report += """
+    parts.append("""
 ---
 
 ## 下周关注
@@ -162,9 +171,9 @@ def generate_review(start_date, end_date, archives):
 ---
 
 > 此报告由系统自动生成
-"""
+""")
 
-    return report
+    return ''.join(parts)
 
 def main():
     print(f"[{datetime.now()}] 开始生成周复盘报告...")
@@ -191,7 +200,8 @@ def main():
     print("正在同步到云端...")
     sync_script = Path(__file__).parent / "sync.py"
     if sync_script.exists():
-        os.system(f'python3 "{sync_script}" --file "{report_file}"')
+        # 不经过 shell，路径里有空格/引号也安全
+        subprocess.run([sys.executable, str(sync_script), "--file", str(report_file)], check=False)
 
     print(f"[{datetime.now()}] 周复盘完成!")
 
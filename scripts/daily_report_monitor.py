@@ -7,8 +7,16 @@
 import requests
 import os
 import sys
-from datetime import datetime, timedelta
-from collections import defaultdict
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dt_time, timedelta
+from functools import lru_cache
+from itertools import groupby
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from feishu_cache import CACHE_DIR, TOKEN_CACHE_FILE, TOKEN_REFRESH_MARGIN, read_cache, write_cache
 
 # 配置
 FEISHU_APP_ID = os.getenv("FEISHU_APP_ID")
@@ -23,6 +31,11 @@ KNOWLEDGE_BITABLE_TOKEN = os.getenv("FEISHU_BITABLE_TOKEN", "WbGHbhWiTamEQ2scH8r
 
 WEBHOOK_URL = "https://open.feishu.cn/open-apis/bot/v2/hook/86407aaf-b12e-4cb7-ba88-23f7e7db57eb"
 
+# 本地缓存：令牌约2小时有效（与 sync.py 等共用 feishu_cache 中的 token 缓存），跟进事项表ID基本不变
+FOLLOWUPS_CACHE_FILE = CACHE_DIR / "followups_table.json"
+# token 失效（过期/被作废）的错误码
+TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+
 # 管培生名单（用户ID -> 真名）
 NAME_MAPPING = {
     "用户569150": "陈佳俊",
@@ -31,15 +44,53 @@ NAME_MAPPING = {
 # 应该填报的人员列表
 EXPECTED_MEMBERS = ["单秋收", "陈佳俊"]
 
+# 周报工作要点中视为"没写"的内容
+SKIP_CONTENT = frozenset(("", "无", "暂无", "-", "/"))
+
+# 所有请求共用一个连接池，避免每次重新握手；GET 遇到 429/5xx 自动重试
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "ai-knowledge/1.0"})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=2, pool_maxsize=4,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+
+def get_access_token(force_refresh=False):
+    """获取飞书访问令牌（缓存未过期时直接复用；force_refresh 时丢弃缓存重新获取）"""
+    cache = {} if force_refresh else read_cache(TOKEN_CACHE_FILE)
+    if cache.get("app_id") == FEISHU_APP_ID and cache.get("expires_at", 0) - time.time() > TOKEN_REFRESH_MARGIN:
+        return cache.get("token")
+    if force_refresh:
+        write_cache(TOKEN_CACHE_FILE, {})
 
-def get_access_token():
-    """获取飞书访问令牌"""
     url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
-    resp = requests.post(url, json={
+    resp = SESSION.post(url, json={
         "app_id": FEISHU_APP_ID,
         "app_secret": FEISHU_APP_SECRET
     })
-    return resp.json().get("tenant_access_token")
+    data = resp.json()
+    token = data.get("tenant_access_token")
+    if token:
+        write_cache(TOKEN_CACHE_FILE, {
+            "app_id": FEISHU_APP_ID,
+            "token": token,
+            "expires_at": time.time() + data.get("expire", 0),
+        })
+    return token
+
+
+def _api_get(url, token, params=None):
+    """GET 飞书接口，返回 (JSON, token)；token 失效时重新获取一次后重试，调用方后续请求改用新 token"""
+    resp = SESSION.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+    data = resp.json()
+    if resp.status_code == 401 or data.get("code") in TOKEN_INVALID_CODES:
+        new_token = get_access_token(force_refresh=True)
+        if new_token:
+            token = new_token
+            resp = SESSION.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+            data = resp.json()
+    return data, token
 
 
 def parse_name(name_field):
@@ -50,101 +101,140 @@ def parse_name(name_field):
     return str(name_field) if name_field else "未知"
 
 
+@lru_cache(maxsize=1024)
+def _datetime_from_ms(ms):
+    """毫秒时间戳转本地时间（日期字段多为当天零点，重复值很多）"""
+    return datetime.fromtimestamp(ms / 1000)
+
+
 def parse_date(date_val):
     """解析日期字段"""
     if isinstance(date_val, (int, float)) and date_val > 0:
-        return datetime.fromtimestamp(date_val / 1000)
+        return _datetime_from_ms(date_val)
     return None
 
 
 def get_all_records(token, bitable_token=BITABLE_TOKEN, table_id=TABLE_ID):
-    """获取所有日报记录"""
-    headers = {"Authorization": f"Bearer {token}"}
+    """获取所有日报记录；接口出错时返回 None（不能当作没有记录）"""
     all_records = []
     page_token = None
 
+    url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{bitable_token}/tables/{table_id}/records"
+
     while True:
-        params = {"page_size": 100}
+        params = {"page_size": 500}  # 接口上限，减少翻页次数
         if page_token:
             params["page_token"] = page_token
 
-        url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{bitable_token}/tables/{table_id}/records"
-        resp = requests.get(url, headers=headers, params=params)
-        data = resp.json()
+        data, token = _api_get(url, token, params)
 
         if data.get("code") != 0:
-            break
+            print(f"拉取记录失败: {data.get('code')} {data.get('msg')}")
+            return None
 
-        items = data.get("data", {}).get("items", [])
-        all_records.extend(items)
+        page = data.get("data") or {}
+        all_records.extend(page.get("items") or [])
 
-        if not data.get("data", {}).get("has_more"):
+        if not page.get("has_more"):
             break
-        page_token = data.get("data", {}).get("page_token")
+        page_token = page.get("page_token")
 
     return all_records
 
 
 def get_followups_table_id(token):
-    """获取跟进事项表的table_id"""
-    headers = {"Authorization": f"Bearer {token}"}
+    """获取跟进事项表的table_id（优先读缓存）；没有该表时返回空字符串，接口出错时返回 None"""
+    cache = read_cache(FOLLOWUPS_CACHE_FILE)
+    if cache.get("bitable_token") == KNOWLEDGE_BITABLE_TOKEN and cache.get("table_id"):
+        return cache["table_id"]
+
     url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{KNOWLEDGE_BITABLE_TOKEN}/tables"
-    resp = requests.get(url, headers=headers)
-    data = resp.json()
+    data, _ = _api_get(url, token)
 
     if data.get("code") == 0:
-        for table in data.get("data", {}).get("items", []):
+        for table in (data.get("data") or {}).get("items") or []:
             if table.get("name") == "跟进事项":
-                return table.get("table_id")
+                table_id = table.get("table_id")
+                write_cache(FOLLOWUPS_CACHE_FILE, {
+                    "bitable_token": KNOWLEDGE_BITABLE_TOKEN,
+                    "table_id": table_id,
+                })
+                return table_id
+        return ""
+    print(f"获取数据表列表失败: {data.get('code')} {data.get('msg')}")
     return None
 
 
 def get_pending_followups(token):
-    """获取未完成的跟进事项"""
+    """获取未完成的跟进事项；接口出错时返回 None（不能当作没有待跟进事项）"""
     table_id = get_followups_table_id(token)
+    if table_id is None:
+        return None
     if not table_id:
-        return []
+        return []  # 没有跟进事项表，无事可报
 
-    headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://open.feishu.cn/open-apis/bitable/v1/apps/{KNOWLEDGE_BITABLE_TOKEN}/tables/{table_id}/records"
-    resp = requests.get(url, headers=headers, params={"page_size": 100})
-    data = resp.json()
+    items = get_all_records(token, KNOWLEDGE_BITABLE_TOKEN, table_id)
+    if items is None:
+        # 接口报错时表ID可能已失效，下次重新查找（表里确实没有记录时保留缓存）
+        write_cache(FOLLOWUPS_CACHE_FILE, {})
+        return None
 
     pending = []
-    if data.get("code") == 0:
-        for item in data.get("data", {}).get("items", []):
-            fields = item.get("fields", {})
-            status = fields.get("状态", "")
-            if status in ["待跟进", "跟进中"]:
-                pending.append({
-                    "人员": fields.get("人员", ""),
-                    "事项": fields.get("事项", ""),
-                    "状态": status,
-                    "来源日期": parse_date(fields.get("来源日期")),
-                })
+    for item in items:
+        fields = item.get("fields", {})
+        status = fields.get("状态", "")
+        if status in ["待跟进", "跟进中"]:
+            pending.append({
+                "人员": fields.get("人员", ""),
+                "事项": fields.get("事项", ""),
+                "状态": status,
+                "来源日期": parse_date(fields.get("来源日期")),
+            })
     return pending
 
 
-def get_daily_details(records, check_date):
-    """获取指定日期的详细日报内容"""
-    filled_members = set()
-    details = []
+def index_records(records):
+    """解析日报记录并按日期排序（每条记录只解析一次）
 
+    返回 {"dates": [...], "reports": [...]}，两个列表一一对应，
+    dates 单独保存以便二分查找日期区间
+    """
+    reports = []
     for record in records:
         fields = record.get("fields", {})
         record_date = parse_date(fields.get("日期"))
-        name = parse_name(fields.get("姓名"))
-
-        if record_date and record_date.date() == check_date.date():
-            filled_members.add(name)
-            details.append({
-                "name": name,
-                "decision": fields.get("今日决策时刻(选1个你做过判断/选择的时刻)", "") or "",
-                "choice": fields.get("我的选择：", "") or "",
-                "result": fields.get("结果：", "") or "",
-                "problem_action": fields.get("发现的问题 + 我的行动(不要只提问题,要说你做了什么)", "") or "",
-                "need_support": fields.get("需要支持的地方(只写1个最需要的)", "") or "",
-            })
+        if not record_date:
+            continue
+        reports.append({
+            "date": record_date,
+            "date_mmdd": record_date.strftime("%m/%d"),
+            "name": parse_name(fields.get("姓名")),
+            "decision": fields.get("今日决策时刻(选1个你做过判断/选择的时刻)", "") or "",
+            "choice": fields.get("我的选择：", "") or "",
+            "result": fields.get("结果：", "") or "",
+            "problem_action": fields.get("发现的问题 + 我的行动(不要只提问题,要说你做了什么)", "") or "",
+            "need_support": fields.get("需要支持的地方(只写1个最需要的)", "") or "",
+        })
+    reports.sort(key=lambda r: r["date"])
+    return {"dates": [r["date"] for r in reports], "reports": reports}
+
+
+def reports_between(index, start, end):
+    """二分取出日期在 [start, end] 内的日报"""
+    lo = bisect_left(index["dates"], start)
+    hi = bisect_right(index["dates"], end)
+    return index["reports"][lo:hi]
+
+
+def get_daily_details(index, check_date):
+    """获取指定日期的详细日报内容"""
+    filled_members = set()
+    details = []
+
+    day = check_date.date()
+    for report in reports_between(index, datetime.combine(day, dt_time.min), datetime.combine(day, dt_time.max)):
+        filled_members.add(report["name"])
+        details.append(report)
 
     missing_members = [m for m in EXPECTED_MEMBERS if m not in filled_members]
 
@@ -211,38 +301,27 @@ def send_daily_notification(result):
         }
     }
 
-    resp = requests.post(WEBHOOK_URL, json=message)
+    resp = SESSION.post(WEBHOOK_URL, json=message)
     return resp.json()
 
 
-def generate_weekly_summary(records, week_start, week_end):
+def generate_weekly_summary(index, week_start, week_end):
     """生成周报汇总"""
     # 筛选本周数据
-    week_data = []
-    for record in records:
-        fields = record.get("fields", {})
-        record_date = parse_date(fields.get("日期"))
-        if record_date and week_start <= record_date <= week_end:
-            week_data.append({
-                "date": record_date,
-                "name": parse_name(fields.get("姓名")),
-                "decision": fields.get("今日决策时刻(选1个你做过判断/选择的时刻)", "") or "",
-                "choice": fields.get("我的选择：", "") or "",
-                "result": fields.get("结果：", "") or "",
-                "problem_action": fields.get("发现的问题 + 我的行动(不要只提问题,要说你做了什么)", "") or "",
-                "need_support": fields.get("需要支持的地方(只写1个最需要的)", "") or "",
-            })
+    week_data = reports_between(index, week_start, week_end)
 
-    # 统计填报情况
-    by_person = defaultdict(list)
-    for d in week_data:
-        by_person[d["name"]].append(d)
+    # 按人分组：索引已按日期升序，倒序后按姓名稳定排序，组内即为日期倒序
+    by_person = {
+        name: list(reports)
+        for name, reports in groupby(sorted(reversed(week_data), key=lambda r: r["name"]),
+                                     key=lambda r: r["name"])
+    }
 
     # 统计每人填报天数
     fill_stats = []
     for name in EXPECTED_MEMBERS:
         reports = by_person.get(name, [])
-        dates = set(r["date"].strftime("%m/%d") for r in reports)
+        dates = {r["date_mmdd"] for r in reports}
         fill_stats.append(f"• {name}：{len(dates)}天/7天")
 
     # 提取主要工作内容（按人）
@@ -251,10 +330,11 @@ def generate_weekly_summary(records, week_start, week_end):
         reports = by_person.get(name, [])
         if reports:
             work_items = []
-            for r in sorted(reports, key=lambda x: x["date"], reverse=True)[:5]:
+            for r in reports[:5]:
                 content = r["decision"] or r["problem_action"]
-                if content and content not in ["无", "暂无"]:
-                    work_items.append(f"  - {r['date'].strftime('%m/%d')}: {content[:40]}...")
+                if content not in SKIP_CONTENT:
+                    short = content[:40]
+                    work_items.append(f"  - {r['date_mmdd']}: {short}...")
             if work_items:
                 work_summary.append(f"**{name}**\n" + "\n".join(work_items[:3]))
 
@@ -268,7 +348,7 @@ def generate_weekly_summary(records, week_start, week_end):
 
 
 def send_weekly_notification(summary, pending_followups):
-    """发送周报汇总"""
+    """发送周报汇总（pending_followups 为 None 表示跟进事项获取失败）"""
     week_str = f"{summary['week_start'].strftime('%m/%d')} - {summary['week_end'].strftime('%m/%d')}"
 
     elements = [
@@ -286,7 +366,9 @@ def send_weekly_notification(summary, pending_followups):
         elements.append({"tag": "hr"})
 
     # 添加未完成跟进事项
-    if pending_followups:
+    if pending_followups is None:
+        elements.append({"tag": "div", "text": {"tag": "lark_md", "content": "**🚨 未完成跟进事项**\n⚠️ 跟进事项获取失败，本周暂无法统计"}})
+    elif pending_followups:
         followup_content = "**🚨 未完成跟进事项**\n"
         for f in pending_followups:
             date_str = f["来源日期"].strftime("%m/%d") if f["来源日期"] else "未知"
@@ -306,7 +388,7 @@ def send_weekly_notification(summary, pending_followups):
         }
     }
 
-    resp = requests.post(WEBHOOK_URL, json=message)
+    resp = SESSION.post(WEBHOOK_URL, json=message)
     return resp.json()
 
 
@@ -320,13 +402,17 @@ def run_daily_check():
         return
 
     records = get_all_records(token)
+    if records is None:
+        print("获取日报记录失败，跳过推送")
+        return
     print(f"获取到 {len(records)} 条日报记录")
+    index = index_records(records)
 
     # 检查昨天的日报
     yesterday = (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
     print(f"检查日期：{yesterday.strftime('%Y-%m-%d')}")
 
-    result = get_daily_details(records, yesterday)
+    result = get_daily_details(index, yesterday)
     print(f"已填：{result['filled']}")
     print(f"漏填：{result['missing']}")
 
@@ -343,8 +429,17 @@ def run_weekly_summary():
         print("获取飞书令牌失败")
         return
 
-    records = get_all_records(token)
+    # 日报记录和跟进事项互不依赖，并行拉取
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        records_future = pool.submit(get_all_records, token)
+        followups_future = pool.submit(get_pending_followups, token)
+        records = records_future.result()
+        pending_followups = followups_future.result()
+    if records is None:
+        print("获取日报记录失败，跳过推送")
+        return
     print(f"获取到 {len(records)} 条日报记录")
+    index = index_records(records)
 
     # 计算上周的时间范围（上周一到上周日）
     today = datetime.now()
@@ -359,11 +454,11 @@ def run_weekly_summary():
 
     print(f"汇总周期：{last_monday.strftime('%Y-%m-%d')} 至 {last_sunday.strftime('%Y-%m-%d')}")
 
-    summary = generate_weekly_summary(records, last_monday, last_sunday)
-
-    # 获取未完成的跟进事项
-    pending_followups = get_pending_followups(token)
-    print(f"未完成跟进事项：{len(pending_followups)} 条")
+    summary = generate_weekly_summary(index, last_monday, last_sunday)
+    if pending_followups is None:
+        print("获取跟进事项失败，周报中标注为暂无法统计")
+    else:
+        print(f"未完成跟进事项：{len(pending_followups)} 条")
 
     resp = send_weekly_notification(summary, pending_followups)
     print(f"通知发送结果：{resp}")
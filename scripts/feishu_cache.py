@@ -0,0 +1,76 @@
+"""
+飞书鉴权缓存
+tenant_access_token 约2小时有效，数据表ID基本不变，缓存到本地后
+sync.py / fetch_feishu.py 等脚本启动时不必每次都重新请求
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+# 缓存放在用户目录，避免凭据进入仓库（与 daily_report_monitor.py 共用同一个 token 缓存）
+CACHE_DIR = Path.home() / ".cache" / "ai-knowledge"
+TOKEN_CACHE_FILE = CACHE_DIR / "feishu_token.json"
+TABLES_CACHE_FILE = CACHE_DIR / "feishu_tables.json"
+# 各记录上次写入飞书的字段哈希（内容未变时跳过更新）
+RECORD_HASHES_FILE = CACHE_DIR / "record_hashes.json"
+# token 剩余有效期低于该值（秒）时重新获取
+TOKEN_REFRESH_MARGIN = 300
+# 数据表ID缓存有效期（秒）；表被删除重建时，请求返回找不到表也会立即重新获取
+TABLES_CACHE_TTL = 24 * 3600
+
+
+def read_cache(path: Path) -> dict:
+    """读取缓存文件，不存在或损坏时返回空字典"""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache(path: Path, data: dict):
+    """写入缓存文件（先写临时文件再原子替换，中断也不会留下半个文件；失败不影响主流程）"""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_suffix(".json.tmp")
+        tmp_file.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp_file.chmod(0o600)
+        os.replace(tmp_file, path)
+    except OSError:
+        pass
+
+
+def ensure_token(syncer) -> str:
+    """准备 token：缓存未过期时直接复用（缓存读写在 FeishuSync.get_tenant_access_token 中）"""
+    return syncer.get_tenant_access_token()
+
+
+def ensure_table_ids(syncer) -> Dict[str, str]:
+    """准备数据表ID：同一多维表格的表ID基本不变，有效期内不再每次拉取"""
+    cache = read_cache(TABLES_CACHE_FILE)
+    if (cache.get("bitable_token") == syncer.bitable_token and cache.get("table_ids")
+            and time.time() - cache.get("cached_at", 0) < TABLES_CACHE_TTL):
+        syncer.table_ids = cache["table_ids"]
+        return syncer.table_ids
+
+    table_ids = syncer.get_all_table_ids()
+    save_table_ids(syncer.bitable_token, table_ids)
+    return table_ids
+
+
+def save_table_ids(bitable_token: str, table_ids: Dict[str, str]):
+    """缓存数据表ID（为空时清掉旧缓存，下次重新获取）"""
+    if table_ids:
+        write_cache(TABLES_CACHE_FILE, {
+            "bitable_token": bitable_token,
+            "table_ids": table_ids,
+            "cached_at": time.time(),
+        })
+    else:
+        write_cache(TABLES_CACHE_FILE, {})
+
+
+def get_cached_auth(syncer) -> Tuple[str, Dict[str, str]]:
+    """一次准备好 token 和数据表ID（均优先使用缓存）"""
+    return ensure_token(syncer), ensure_table_ids(syncer)
@@ -20,9 +20,13 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from config import FEISHU_APP_ID, FEISHU_APP_SECRET, FEISHU_FOLDER_TOKEN
 
+# 优先级 -> 图标（未知优先级按低处理）
+ICON_BY_PRIORITY = {"高": "🔴", "中": "🟡", "低": "🟢"}
+
 
 def fetch_context():
     """从飞书获取上下文"""
+    from feishu_cache import get_cached_auth
     from sync_feishu import FeishuSync
 
     FEISHU_BITABLE_TOKEN = os.getenv("FEISHU_BITABLE_TOKEN", "")
@@ -34,8 +38,7 @@ def fetch_context():
     syncer.bitable_token = FEISHU_BITABLE_TOKEN
 
     try:
-        syncer.get_tenant_access_token()
-        syncer.get_all_table_ids()
+        get_cached_auth(syncer)
         return syncer.get_context_summary()
     except Exception as e:
         return {"error": str(e)}
@@ -43,24 +46,26 @@ def fetch_context():
 
 def format_for_human(context: dict) -> str:
     """格式化为人类可读的摘要"""
-    lines = []
-    lines.append("=" * 50)
-    lines.append(f"📋 飞书状态同步 ({context.get('fetch_time', '')[:16]})")
-    lines.append("=" * 50)
+    threads = context.get("pending_threads", [])
+    archives = context.get("recent_archives", [])
+
+    lines = [
+        "=" * 50,
+        f"📋 飞书状态同步 ({context.get('fetch_time', '')[:16]})",
+        "=" * 50,
+    ]
 
     # 待处理线头
-    threads = context.get("pending_threads", [])
     lines.append(f"\n🧵 待处理线头 ({len(threads)} 条)")
     if threads:
-        for t in threads:
-            priority = t.get("优先级", "中")
-            icon = "🔴" if priority == "高" else "🟡" if priority == "中" else "🟢"
-            lines.append(f"   {icon} {t.get('标题', '')}")
+        lines.extend(
+            f"   {ICON_BY_PRIORITY.get(t.get('优先级', '中'), '🟢')} {t.get('标题', '')}"
+            for t in threads
+        )
     else:
         lines.append("   无待处理事项")
 
     # 最近归档
-    archives = context.get("recent_archives", [])
     lines.append(f"\n📁 最近对话 ({len(archives)} 条)")
     if archives:
         for a in archives:
@@ -80,20 +85,20 @@ def format_for_human(context: dict) -> str:
 
 def format_for_claude(context: dict) -> str:
     """格式化为Claude可读的上下文提示"""
-    lines = []
-    lines.append("<feishu_context>")
-    lines.append(f"同步时间: {context.get('fetch_time', '')[:16]}")
+    threads = context.get("pending_threads", [])
+    archives = context.get("recent_archives", [])
+
+    lines = ["<feishu_context>", f"同步时间: {context.get('fetch_time', '')[:16]}"]
 
     # 待处理线头
-    threads = context.get("pending_threads", [])
     if threads:
         lines.append("\n待处理事项:")
-        for t in threads:
-            priority = t.get("优先级", "中")
-            lines.append(f"- [{priority}] {t.get('标题', '')} (来源: {t.get('来源', '未知')})")
+        lines.extend(
+            f"- [{t.get('优先级', '中')}] {t.get('标题', '')} (来源: {t.get('来源', '未知')})"
+            for t in threads
+        )
 
     # 最近归档
-    archives = context.get("recent_archives", [])
     if archives:
         lines.append("\n最近对话记录:")
         for a in archives:
@@ -119,7 +124,9 @@ def main():
     context = fetch_context()
 
     if args.json:
-        print(json.dumps(context, ensure_ascii=False, indent=2))
+        # 直接流式写到标准输出，不先拼出完整字符串
+        json.dump(context, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
     elif args.context:
         output = format_for_claude(context)
         # 静默模式下，只有有待办或最近记录时才输出
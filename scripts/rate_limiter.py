@@ -0,0 +1,49 @@
+"""
+请求限流工具
+令牌桶限流器（线程安全，多线程共享同一实例即可控制整体速率）+ 被限流后的退避时间计算
+"""
+import random
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """令牌桶限流器：平均每秒 rate 次请求，最多允许 burst 次突发"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，不够时阻塞等到有为止"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None, base: float = 0.5, cap: float = 10.0) -> float:
+    """被限流后的等待秒数：服务端给了等待时间就用它，否则指数退避加随机抖动"""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), cap)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
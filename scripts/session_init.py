@@ -4,6 +4,7 @@
 在 Claude Code 会话开始时自动加载上下文
 """
 
+import mmap
 import os
 import sys
 from pathlib import Path
@@ -12,6 +13,18 @@ from datetime import datetime
 # 项目根目录
 PROJECT_ROOT = Path("/Users/bolin/dev/Claude Code Projects")
 KNOWLEDGE_DIR = PROJECT_ROOT / "AI知识管理系统"
+# 线头文件中待跟进事项的标题（按字节查找，不必解码整个文件）
+THREADS_SECTION = "## 待跟进事项".encode('utf-8')
+
+
+def read_preview(path, limit):
+    """只读文件开头生成预览，超过 limit 个字符时截断并加省略号"""
+    with open(path, 'rb') as f:
+        # UTF-8 每个字符最多4字节，多读一个字符用于判断是否需要截断
+        head = f.read((limit + 1) * 4)
+    content = head.decode('utf-8', errors='ignore').replace('\r\n', '\n')
+    return content[:limit] + "..." if len(content) > limit else content
+
 
 def get_recent_progress():
     """获取最近的项目进度"""
@@ -21,9 +34,8 @@ def get_recent_progress():
     status_file = PROJECT_ROOT / "项目状态.md"
     if status_file.exists():
         try:
-            content = status_file.read_text(encoding='utf-8')
             # 取前800字符，保留关键信息
-            preview = content[:800] + "..." if len(content) > 800 else content
+            preview = read_preview(status_file, 800)
             result.append(f"【项目状态汇总】\n{preview}")
         except:
             pass
@@ -42,8 +54,7 @@ def get_recent_progress():
 
     for pf, _ in progress_files[:2]:  # 最近2个项目
         try:
-            content = pf.read_text(encoding='utf-8')
-            preview = content[:400] + "..." if len(content) > 400 else content
+            preview = read_preview(pf, 400)
             project_name = pf.parent.name
             result.append(f"【{project_name}】\n{preview}")
         except:
@@ -59,15 +70,16 @@ def get_threads():
         return None
 
     try:
-        content = threads_file.read_text(encoding='utf-8')
-        # 提取待跟进事项部分
-        if "## 待跟进事项" in content:
-            start = content.find("## 待跟进事项")
-            end = content.find("---", start + 1)
-            if end == -1:
-                end = len(content)
-            section = content[start:end].strip()
-            return section
+        with open(threads_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            # 提取待跟进事项部分，只解码这一段
+            start = buf.find(THREADS_SECTION)
+            if start != -1:
+                end = buf.find(b"---", start + 1)
+                if end == -1:
+                    end = len(buf)
+                section = buf[start:end].decode('utf-8').replace('\r\n', '\n').strip()
+                return section
     except:
         pass
 
@@ -10,10 +10,14 @@
     python sync.py --init              # 初始化多维表格
 """
 import argparse
+import hashlib
 import json
 import os
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 # 添加当前目录到路径
@@ -23,11 +27,32 @@ from config import (
     BASE_DIR, ARCHIVE_DIR, THREADS_FILE, KNOWLEDGE_DIR, REVIEW_DIR,
     FEISHU_APP_ID, FEISHU_APP_SECRET, FEISHU_FOLDER_TOKEN
 )
+from feishu_cache import ensure_token, ensure_table_ids
+from sync_feishu import (
+    FeishuSync, parse_threads_file, parse_archive_file, sync_to_feishu_batch, sync_with_document
+)
 
 # 同步状态文件
 SYNC_STATE_FILE = Path(__file__).parent / ".sync_state.json"
+# 知识文档摘要：第一行非空、非标题、非分隔线的内容
+SUMMARY_RE = re.compile(r'^\s*(?!#|---)(\S[^\n]*)', re.M)
+# 不参与同步的文件名前缀（模板文件、隐藏文件）
+EXCLUDE_PREFIXES = ("_", ".")
+# 同时同步的文件数（飞书接口有频率限制，不宜过大）
+SYNC_WORKERS = 4
 FEISHU_BITABLE_TOKEN = os.getenv("FEISHU_BITABLE_TOKEN", "")
 
+# 路径关键字 -> 文件类型（按顺序匹配，先命中者优先）
+FILE_CATEGORIES = (
+    ("线头追踪", "threads"),
+    ("对话归档", "archive"),
+    ("知识沉淀", "knowledge"),
+    ("复盘报告", "archive"),  # 复盘报告也作为归档处理
+)
+CATEGORY_KEYWORDS = tuple(keyword for keyword, _ in FILE_CATEGORIES)
+# 知识类型关键字（按顺序匹配）
+KNOWLEDGE_TYPES = ("方法论", "SOP", "洞见")
+
 
 def load_sync_state() -> dict:
     """加载同步状态"""
@@ -40,148 +65,215 @@ def load_sync_state() -> dict:
 def save_sync_state(state: dict):
     """保存同步状态"""
     state["last_sync"] = datetime.now().isoformat()
-    with open(SYNC_STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
-
-
-def get_all_md_files() -> list:
-    """获取所有待同步的Markdown文件"""
+    # 先写临时文件再原子替换，写到一半中断也不会损坏原状态文件
+    tmp_file = SYNC_STATE_FILE.with_suffix(".json.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_file, SYNC_STATE_FILE)
+
+
+def _walk_md(root: Path):
+    """递归遍历目录，产出 (路径, stat)；stat 复用 scandir 的结果，不再单独 stat"""
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".md") and not entry.name.startswith(EXCLUDE_PREFIXES):
+                    yield Path(entry.path), entry.stat()
+
+
+def scan_md_files() -> list:
+    """获取所有待同步的Markdown文件及其 stat（排除模板和隐藏文件）"""
     files = []
 
     # 对话归档
     if ARCHIVE_DIR.exists():
-        files.extend(ARCHIVE_DIR.rglob("*.md"))
+        files.extend(_walk_md(ARCHIVE_DIR))
 
     # 线头追踪
     if THREADS_FILE.exists():
-        files.append(THREADS_FILE)
+        files.append((THREADS_FILE, THREADS_FILE.stat()))
 
     # 知识沉淀
     if KNOWLEDGE_DIR.exists():
-        files.extend(KNOWLEDGE_DIR.rglob("*.md"))
+        files.extend(_walk_md(KNOWLEDGE_DIR))
 
     # 复盘报告
     if REVIEW_DIR.exists():
-        files.extend(REVIEW_DIR.rglob("*.md"))
-
-    # 排除模板文件
-    files = [f for f in files if not f.name.startswith("_")]
+        files.extend(_walk_md(REVIEW_DIR))
 
     return files
 
 
+def get_all_md_files() -> list:
+    """获取所有待同步的Markdown文件"""
+    return [f for f, _ in scan_md_files()]
+
+
+def file_hash(file_path: Path) -> str:
+    """计算文件内容哈希（分块读取，大文件不整体载入内存）"""
+    h = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def get_new_files(state: dict) -> list:
-    """获取新增或修改的文件"""
-    all_files = get_all_md_files()
+    """获取新增或修改的文件（按内容哈希判断，mtime 仅用于快速跳过）"""
     synced = state.get("synced_files", {})
 
     new_files = []
-    for f in all_files:
-        f_str = str(f)
-        mtime = f.stat().st_mtime
+    for f, st in scan_md_files():
+        record = synced.get(str(f))
+        if record is None:
+            new_files.append(f)
+            continue
 
-        if f_str not in synced or synced[f_str]["mtime"] < mtime:
+        # mtime 和大小都没变，视为未修改，不必读文件
+        if record.get("mtime") == st.st_mtime and record.get("size") == st.st_size:
+            continue
+
+        # touch 过或从备份恢复的文件：内容没变就不重复同步
+        if record.get("hash") != file_hash(f):
             new_files.append(f)
 
     return new_files
 
 
+@lru_cache(maxsize=1024)
+def _first_keyword(keywords: tuple, text: str) -> int:
+    """text 中按顺序最先命中的关键字下标，都不命中时返回 len(keywords)"""
+    return next((i for i, keyword in enumerate(keywords) if keyword in text), len(keywords))
+
+
+def _match_path(keywords: tuple, file_path: Path) -> int:
+    """按顺序匹配路径关键字
+
+    同一目录下的文件共用目录部分的匹配结果（按目录缓存），
+    文件名只需再检查优先级更高的关键字
+    """
+    hit = _first_keyword(keywords, str(file_path.parent))
+    name = file_path.name
+    return next((i for i, keyword in enumerate(keywords[:hit]) if keyword in name), hit)
+
+
 def classify_file(file_path: Path) -> str:
     """根据文件路径分类"""
-    path_str = str(file_path)
-
-    if "线头追踪" in path_str or file_path.name == "THREADS.md":
+    if file_path.name == "THREADS.md":
         return "threads"
-    elif "对话归档" in path_str:
-        return "archive"
-    elif "知识沉淀" in path_str:
-        return "knowledge"
-    elif "复盘报告" in path_str:
-        return "archive"  # 复盘报告也作为归档处理
-    else:
-        return "knowledge"
+    i = _match_path(CATEGORY_KEYWORDS, file_path)
+    return FILE_CATEGORIES[i][1] if i < len(FILE_CATEGORIES) else "knowledge"
 
 
-def sync_file(file_path: Path, syncer, state: dict) -> bool:
-    """同步单个文件到飞书多维表格"""
-    from sync_feishu import (
-        parse_threads_file, parse_archive_file, sync_to_feishu
-    )
+def classify_knowledge(file_path: Path) -> str:
+    """根据文件路径判断知识类型"""
+    i = _match_path(KNOWLEDGE_TYPES, file_path)
+    return KNOWLEDGE_TYPES[i] if i < len(KNOWLEDGE_TYPES) else "其他"
 
+
+def payload_hash(*parts) -> str:
+    """计算待发送内容的哈希，用于判断与上次同步的内容是否一致"""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def _unchanged(previous: dict, digest: str, log) -> bool:
+    """待发送内容与上次同步一致时跳过，不发任何请求"""
+    if previous.get("payload_hash") == digest:
+        log("      ⏭ 内容未变化，跳过")
+        return True
+    return False
+
+
+def _handle_threads(file_path: Path, syncer, previous: dict, log) -> tuple:
+    """线头文件：解析每个线头，同步到表格"""
+    threads = parse_threads_file(file_path)
+    log(f"      解析到 {len(threads)} 个线头")
+    digest = payload_hash(threads)
+    if _unchanged(previous, digest, log):
+        return True, {"payload_hash": digest}
+
+    synced_count = sum(sync_to_feishu_batch(syncer, "thread", threads))
+    log(f"      同步 {synced_count}/{len(threads)} 个线头")
+    return synced_count > 0, {"payload_hash": digest}
+
+
+def _handle_archive(file_path: Path, syncer, previous: dict, log) -> tuple:
+    """归档文件：提取元信息 + 创建详情文档（文件只读一次）"""
+    content = file_path.read_text(encoding="utf-8")
+    meta = parse_archive_file(file_path, content)
+    # 文档正文也计入哈希，内容未变时连详情文档也不重建
+    digest = payload_hash(meta, content)
+    if _unchanged(previous, digest, log):
+        return True, {"payload_hash": digest}
+
+    # 创建详情文档 + 同步元信息到表格
+    success = sync_with_document(syncer, "archive", meta, file_path.stem, content)
+    if success:
+        log(f"      ✓ 归档索引已更新")
+    return success, {"payload_hash": digest}
+
+
+def _handle_knowledge(file_path: Path, syncer, previous: dict, log) -> tuple:
+    """知识沉淀：创建文档 + 索引"""
+    content = file_path.read_text(encoding="utf-8")
+
+    # 提取摘要（第一段非标题内容）
+    match = SUMMARY_RE.search(content)
+    summary = match.group(1).strip()[:200] if match else ""
+
+    data = {
+        "标题": file_path.stem,
+        "类型": classify_knowledge(file_path),
+        "摘要": summary
+    }
+    digest = payload_hash(data, content)
+    if _unchanged(previous, digest, log):
+        return True, {"payload_hash": digest}
+
+    # 创建详情文档 + 同步到表格
+    success = sync_with_document(syncer, "knowledge", data, file_path.stem, content)
+    if success:
+        log(f"      ✓ 知识索引已更新")
+    return success, {"payload_hash": digest}
+
+
+# 文件类型 -> 处理函数 (文件, 同步器, 上次同步状态, 日志)，返回 (是否成功, 需额外写入同步状态的字段)
+HANDLERS = {
+    "threads": _handle_threads,
+    "archive": _handle_archive,
+    "knowledge": _handle_knowledge,
+}
+
+
+def sync_file(file_path: Path, syncer, state: dict, log=print, force: bool = False) -> bool:
+    """同步单个文件到飞书多维表格
+
+    log 用于输出进度，并发同步时传入缓冲函数，避免多个文件的输出交错；
+    force 为 True 时忽略上次同步的内容哈希，总是重新发送
+    """
     file_type = classify_file(file_path)
-    success = False
+    previous = {} if force else state["synced_files"].get(str(file_path), {})
 
     try:
-        if file_type == "threads":
-            # 线头文件：解析每个线头，同步到表格
-            threads = parse_threads_file(file_path)
-            print(f"      解析到 {len(threads)} 个线头")
-            synced_count = 0
-            for thread in threads:
-                if sync_to_feishu(syncer, "thread", thread):
-                    synced_count += 1
-            print(f"      同步 {synced_count}/{len(threads)} 个线头")
-            success = synced_count > 0
-
-        elif file_type == "archive":
-            # 归档文件：提取元信息 + 创建详情文档
-            meta = parse_archive_file(file_path)
-
-            # 创建详情文档
-            content = file_path.read_text(encoding="utf-8")
-            doc_url = syncer.create_document(file_path.stem, content)
-
-            # 同步元信息到表格
-            success = sync_to_feishu(syncer, "archive", meta, doc_url)
-            if success:
-                print(f"      ✓ 归档索引已更新")
-
-        elif file_type == "knowledge":
-            # 知识沉淀：创建文档 + 索引
-            content = file_path.read_text(encoding="utf-8")
-
-            # 判断类型
-            knowledge_type = "其他"
-            path_str = str(file_path)
-            if "方法论" in path_str:
-                knowledge_type = "方法论"
-            elif "SOP" in path_str:
-                knowledge_type = "SOP"
-            elif "洞见" in path_str:
-                knowledge_type = "洞见"
-
-            # 提取摘要（第一段非标题内容）
-            lines = content.split('\n')
-            summary = ""
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('#') and not line.startswith('---'):
-                    summary = line[:200]
-                    break
-
-            # 创建详情文档
-            doc_url = syncer.create_document(file_path.stem, content)
-
-            # 同步到表格
-            data = {
-                "标题": file_path.stem,
-                "类型": knowledge_type,
-                "摘要": summary
-            }
-            success = sync_to_feishu(syncer, "knowledge", data, doc_url)
-            if success:
-                print(f"      ✓ 知识索引已更新")
-
+        success, state_update = HANDLERS[file_type](file_path, syncer, previous, log)
     except Exception as e:
-        print(f"      ✗ 同步失败: {e}")
+        log(f"      ✗ 同步失败: {e}")
         return False
 
     # 更新状态
     if success:
+        st = file_path.stat()
         state["synced_files"][str(file_path)] = {
-            "mtime": file_path.stat().st_mtime,
+            "hash": file_hash(file_path),
+            "size": st.st_size,
+            "mtime": st.st_mtime,
             "synced_at": datetime.now().isoformat(),
-            "type": file_type
+            "type": file_type,
+            **state_update
         }
 
     return success
@@ -236,9 +328,8 @@ def main():
         return
 
     # 初始化同步器
-    from sync_feishu import FeishuSync
     syncer = FeishuSync()
-    syncer.get_tenant_access_token()
+    ensure_token(syncer)
 
     # 初始化多维表格
     if args.init:
@@ -257,7 +348,7 @@ def main():
         return
 
     syncer.bitable_token = FEISHU_BITABLE_TOKEN
-    syncer.get_all_table_ids()
+    ensure_table_ids(syncer)
 
     state = load_sync_state()
 
@@ -269,7 +360,7 @@ def main():
             return
 
         print(f"📤 同步文件: {file_path.name}")
-        if sync_file(file_path, syncer, state):
+        if sync_file(file_path, syncer, state, force=True):
             save_sync_state(state)
             print("✅ 同步完成")
         else:
@@ -287,11 +378,19 @@ def main():
             return
         print(f"📤 同步新增/修改的文件 ({len(files)} 个)")
 
+    def sync_buffered(f):
+        lines = [f"\n   📄 {f.name}"]
+        return sync_file(f, syncer, state, log=lines.append, force=args.all), lines
+
+    # 多个文件并发同步；每个文件的输出缓冲后整段打印
     success = 0
-    for f in files:
-        print(f"\n   📄 {f.name}")
-        if sync_file(f, syncer, state):
-            success += 1
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+        futures = [pool.submit(sync_buffered, f) for f in files]
+        for future in as_completed(futures):
+            ok, lines = future.result()
+            print("\n".join(lines))
+            if ok:
+                success += 1
 
     save_sync_state(state)
     print(f"\n✅ 同步完成: {success}/{len(files)} 成功")
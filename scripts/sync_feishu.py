@@ -2,21 +2,60 @@
 飞书同步模块
 将知识管理系统的内容同步到飞书多维表格
 """
+import hashlib
 import json
 import re
+import threading
+import time
+import uuid
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, List
 import os
 
 from config import FEISHU_APP_ID, FEISHU_APP_SECRET
+from feishu_cache import (
+    RECORD_HASHES_FILE, TOKEN_CACHE_FILE, TOKEN_REFRESH_MARGIN, read_cache, save_table_ids, write_cache,
+)
+from rate_limiter import RateLimiter, backoff_delay
 
 # 飞书云文档文件夹 Token
 FEISHU_FOLDER_TOKEN = os.getenv("FEISHU_FOLDER_TOKEN", "")
 # 飞书多维表格 Token（首次运行后会自动创建并保存）
 FEISHU_BITABLE_TOKEN = os.getenv("FEISHU_BITABLE_TOKEN", "")
 
+# 请求超时（连接, 读取）
+REQUEST_TIMEOUT = (3.05, 30)
+# Markdown 分割线
+DIVIDERS = frozenset(('---', '***', '___'))
+# 标题级别 -> (block_type, 块字段名)
+HEADING_BLOCKS = {1: (3, "heading1"), 2: (4, "heading2"), 3: (5, "heading3")}
+# 飞书接口限流：所有 FeishuSync 实例、所有线程共享一个令牌桶
+FEISHU_LIMITER = RateLimiter(rate=10, burst=5)
+# 请求频率超限时飞书返回的错误码，及退避重试次数
+RATE_LIMITED_CODE = 99991400
+RATE_LIMIT_RETRIES = 3
+# token 无效/过期时飞书返回的错误码
+TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+# 数据表不存在（被删除或重建）的错误码：WrongTableId / TableIdNotFound
+TABLE_NOT_FOUND_CODES = {1254004, 1254041}
+
+
+def _new_session() -> requests.Session:
+    """创建带连接池和重试的 Session（keep-alive 复用 TLS 连接）"""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    # 429 不在这里重试：交给 FeishuSync._send，重试时同样经过限流器并按服务端给的时间退避
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
 
 class FeishuSync:
     """飞书同步器（多维表格版）"""
@@ -112,36 +151,105 @@ class FeishuSync:
         }
     }
 
+    # 表名 -> 表格key（反向索引，查表ID时直接按名字查）
+    _NAME_TO_KEY = {config["name"]: key for key, config in TABLES_CONFIG.items()}
+
     def __init__(self):
         self.app_id = FEISHU_APP_ID
         self.app_secret = FEISHU_APP_SECRET
         self.folder_token = FEISHU_FOLDER_TOKEN
         self.bitable_token = FEISHU_BITABLE_TOKEN
         self.access_token = None
+        self.token_expires_at = 0  # token 过期时间（epoch 秒）
+        self._token_lock = threading.Lock()
         self.table_ids = {}  # 缓存表格ID
+        self.indexes = {}  # 查重索引缓存：(表key, 查重字段) -> {字段值: 记录}
+        self._index_lock = threading.Lock()
+        self._table_locks = {}
+        self._key_locks = {}
+        self.record_hashes = None  # 上次写入的字段哈希，首次使用时从本地缓存加载
+        self._hash_lock = threading.Lock()
+        self.session = _new_session()  # 所有请求复用同一连接池
+
+    def get_tenant_access_token(self, force_refresh: bool = False) -> str:
+        """获取 tenant_access_token（优先复用本地缓存中未过期的 token）"""
+        if not force_refresh:
+            cache = read_cache(TOKEN_CACHE_FILE)
+            if cache.get("app_id") == self.app_id and cache.get("expires_at", 0) - time.time() > TOKEN_REFRESH_MARGIN:
+                self.access_token = cache["token"]
+                self.token_expires_at = cache["expires_at"]
+                return self.access_token
 
-    def get_tenant_access_token(self) -> str:
-        """获取 tenant_access_token"""
         url = f"{self.BASE_URL}/auth/v3/tenant_access_token/internal"
-        resp = requests.post(url, json={
+        _, data = self._send("POST", url, json={
             "app_id": self.app_id,
             "app_secret": self.app_secret
         })
-        data = resp.json()
         if data.get("code") == 0:
             self.access_token = data["tenant_access_token"]
+            self.token_expires_at = time.time() + data.get("expire", 0)
+            write_cache(TOKEN_CACHE_FILE, {
+                "app_id": self.app_id,
+                "token": self.access_token,
+                "expires_at": self.token_expires_at,
+            })
             return self.access_token
         else:
             raise Exception(f"获取飞书token失败: {data}")
 
     def _headers(self) -> dict:
-        """请求头"""
-        if not self.access_token:
-            self.get_tenant_access_token()
-        return {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
+        """鉴权请求头（Content-Type 已在 Session 上统一设置）；内存中的 token 临近过期才重新获取"""
+        if self.token_expires_at - time.time() <= TOKEN_REFRESH_MARGIN:
+            # 多线程同时发现过期时只由一个线程刷新
+            with self._token_lock:
+                if self.token_expires_at - time.time() <= TOKEN_REFRESH_MARGIN:
+                    self.get_tenant_access_token()
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    def _send(self, method: str, url: str, **kwargs):
+        """限流后发送请求；被限流（429 / 频率超限错误码）时退避重试，返回 (响应, JSON)"""
+        payload = kwargs.pop("json", None)
+        if payload is not None:
+            # 自行编码：紧凑分隔符、中文不转义为 \uXXXX，请求体更小（Content-Type 已在 Session 上设置）
+            kwargs["data"] = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            FEISHU_LIMITER.acquire()
+            resp = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            if resp.status_code != 429:
+                data = resp.json()
+                if data.get("code") != RATE_LIMITED_CODE:
+                    return resp, data
+            if attempt < RATE_LIMIT_RETRIES:
+                time.sleep(backoff_delay(attempt, resp.headers.get("x-ogw-ratelimit-reset")))
+        return resp, resp.json()
+
+    def _request(self, method: str, url: str, **kwargs) -> dict:
+        """发送请求并返回JSON；token 失效（如缓存的 token 被提前作废）或缓存的表ID已失效时刷新一次后重试"""
+        resp, data = self._send(method, url, headers=self._headers(), **kwargs)
+        if resp.status_code == 401 or data.get("code") in TOKEN_INVALID_CODES:
+            self.get_tenant_access_token(force_refresh=True)
+            resp, data = self._send(method, url, headers=self._headers(), **kwargs)
+        if data.get("code") in TABLE_NOT_FOUND_CODES:
+            url = self._refresh_table_url(url)
+            if url:
+                resp, data = self._send(method, url, headers=self._headers(), **kwargs)
+        return data
+
+    def _refresh_table_url(self, url: str) -> Optional[str]:
+        """表ID失效时重新获取并更新缓存，返回换成新表ID的 URL（表已不存在时返回 None）"""
+        stale = {table_id: key for key, table_id in self.table_ids.items() if f"/tables/{table_id}" in url}
+        if not stale:
+            return None
+        self.get_all_table_ids()
+        save_table_ids(self.bitable_token, self.table_ids)
+        # 旧表的查重索引也不再有效
+        for index_key in [k for k in self.indexes if k[0] in stale.values()]:
+            del self.indexes[index_key]
+        for old_id, key in stale.items():
+            new_id = self.table_ids.get(key)
+            if new_id and new_id != old_id:
+                return url.replace(f"/tables/{old_id}", f"/tables/{new_id}")
+        return None
 
     # ==================== 多维表格操作 ====================
 
@@ -153,8 +261,7 @@ class FeishuSync:
             "folder_token": self.folder_token
         }
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("POST", url, json=payload)
 
         if data.get("code") == 0:
             app_token = data["data"]["app"]["app_token"]
@@ -186,8 +293,7 @@ class FeishuSync:
             }
         }
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("POST", url, json=payload)
 
         if data.get("code") == 0:
             table_id = data["data"]["table_id"]
@@ -204,8 +310,7 @@ class FeishuSync:
     def get_table_id_by_name(self, name: str) -> Optional[str]:
         """根据表名获取表ID"""
         url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables"
-        resp = requests.get(url, headers=self._headers())
-        data = resp.json()
+        data = self._request("GET", url)
 
         if data.get("code") == 0:
             for table in data.get("data", {}).get("items", []):
@@ -219,19 +324,15 @@ class FeishuSync:
             return {}
 
         url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables"
-        resp = requests.get(url, headers=self._headers())
-        data = resp.json()
+        data = self._request("GET", url)
 
         result = {}
         if data.get("code") == 0:
             for table in data.get("data", {}).get("items", []):
-                name = table.get("name")
-                table_id = table.get("table_id")
                 # 映射表名到key
-                for key, config in self.TABLES_CONFIG.items():
-                    if config["name"] == name:
-                        result[key] = table_id
-                        break
+                key = self._NAME_TO_KEY.get(table.get("name"))
+                if key:
+                    result[key] = table.get("table_id")
 
         self.table_ids = result
         return result
@@ -249,9 +350,10 @@ class FeishuSync:
 
         url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables/{table_id}/records"
         payload = {"fields": fields}
+        # 幂等键：_send 限流退避重发、_request 刷新 token / 表ID 后重发时沿用同一个，避免重复插入
+        params = {"client_token": str(uuid.uuid4())}
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("POST", url, params=params, json=payload)
 
         if data.get("code") == 0:
             return data["data"]["record"]["record_id"]
@@ -259,6 +361,36 @@ class FeishuSync:
             print(f"   ⚠ 添加记录失败: {data.get('msg', data)}")
             return None
 
+    def batch_add_records(self, table_key: str, records: List[dict]) -> List[Optional[str]]:
+        """批量添加记录（每次请求最多500条），返回与输入顺序一致的 record_id 列表"""
+        table_id = self.table_ids.get(table_key)
+        if not table_id:
+            self.get_all_table_ids()
+            table_id = self.table_ids.get(table_key)
+
+        if not table_id:
+            print(f"   ✗ 找不到数据表: {table_key}")
+            return [None] * len(records)
+
+        url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables/{table_id}/records/batch_create"
+        record_ids = []
+
+        for i in range(0, len(records), 500):
+            batch = records[i:i+500]
+            payload = {"records": [{"fields": fields} for fields in batch]}
+            # 每批一个幂等键：限流退避或刷新 token / 表ID 后重发同一批时不会插入重复记录
+            params = {"client_token": str(uuid.uuid4())}
+
+            data = self._request("POST", url, params=params, json=payload)
+
+            if data.get("code") == 0:
+                record_ids.extend(r.get("record_id") for r in data["data"]["records"])
+            else:
+                print(f"   ⚠ 批量添加记录失败: {data.get('msg', data)}")
+                record_ids.extend([None] * len(batch))
+
+        return record_ids
+
     def search_record(self, table_key: str, field_name: str, value: str) -> Optional[dict]:
         """搜索记录"""
         table_id = self.table_ids.get(table_key)
@@ -281,8 +413,7 @@ class FeishuSync:
             }
         }
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("POST", url, json=payload)
 
         if data.get("code") == 0:
             items = data.get("data", {}).get("items", [])
@@ -290,6 +421,65 @@ class FeishuSync:
                 return items[0]
         return None
 
+    def _table_lock(self, table_key: str) -> threading.Lock:
+        """每张表一把锁：同一张表只拉取一次，不同的表（归档、知识等）可以同时拉取"""
+        with self._index_lock:
+            return self._table_locks.setdefault(table_key, threading.Lock())
+
+    def key_lock(self, table_key: str, key) -> threading.Lock:
+        """每个查重键一把锁：并发同步同名文件时，查找与新增整体串行，避免都查不到而重复新增"""
+        with self._index_lock:
+            return self._key_locks.setdefault((table_key, key), threading.Lock())
+
+    def load_index(self, table_key: str, key_field: str) -> Dict[str, dict]:
+        """拉取整表建立 查重字段值 -> 记录 的索引，同一次运行内只拉取一次
+
+        记录格式与 search_record 返回的一致：{"record_id": ..., "fields": {...}}
+        拉取失败时抛出异常且不缓存：缺记录的索引会让查重落空、重复新增
+        """
+        with self._table_lock(table_key):
+            index = self.indexes.get((table_key, key_field))
+            if index is None:
+                records = self.list_records(table_key, page_size=500)
+                if records is None:
+                    raise Exception(f"拉取 {table_key} 表已有记录失败，无法查重")
+                index = {}
+                for fields in records:
+                    record_id = fields.pop("_record_id")
+                    # 重复时取第一条，与 search_record 一致
+                    index.setdefault(fields.get(key_field), {"record_id": record_id, "fields": fields})
+                self.indexes[(table_key, key_field)] = index
+            return index
+
+    def remember_record(self, table_key: str, key_field: str, record_id: str, fields: dict):
+        """新增记录后登记到已加载的索引，本次运行内后续查重能找到它"""
+        with self._table_lock(table_key):
+            index = self.indexes.get((table_key, key_field))
+            if index is not None:
+                index.setdefault(fields.get(key_field), {"record_id": record_id, "fields": fields})
+
+    def _hash_key(self, table_key: str, key) -> str:
+        """字段哈希缓存的键（区分不同的多维表格）"""
+        return json.dumps([self.bitable_token, table_key, key], ensure_ascii=False)
+
+    def synced_hash(self, table_key: str, key) -> Optional[str]:
+        """记录上次写入飞书时的字段哈希"""
+        with self._hash_lock:
+            if self.record_hashes is None:
+                self.record_hashes = read_cache(RECORD_HASHES_FILE)
+            return self.record_hashes.get(self._hash_key(table_key, key))
+
+    def remember_hashes(self, table_key: str, hashes: dict):
+        """登记写入成功的记录 {查重键: 字段哈希}，并保存到本地缓存"""
+        if not hashes:
+            return
+        with self._hash_lock:
+            if self.record_hashes is None:
+                self.record_hashes = read_cache(RECORD_HASHES_FILE)
+            for key, digest in hashes.items():
+                self.record_hashes[self._hash_key(table_key, key)] = digest
+            write_cache(RECORD_HASHES_FILE, self.record_hashes)
+
     def update_record(self, table_key: str, record_id: str, fields: dict) -> bool:
         """更新记录"""
         table_id = self.table_ids.get(table_key)
@@ -299,22 +489,52 @@ class FeishuSync:
         url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables/{table_id}/records/{record_id}"
         payload = {"fields": fields}
 
-        resp = requests.put(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("PUT", url, json=payload)
 
         return data.get("code") == 0
 
+    def batch_update_records(self, table_key: str, records: List[tuple]) -> List[bool]:
+        """批量更新记录（每次请求最多500条），records 为 (record_id, fields) 列表"""
+        table_id = self.table_ids.get(table_key)
+        if not table_id:
+            self.get_all_table_ids()
+            table_id = self.table_ids.get(table_key)
+
+        if not table_id:
+            print(f"   ✗ 找不到数据表: {table_key}")
+            return [False] * len(records)
+
+        url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables/{table_id}/records/batch_update"
+        results = []
+
+        for i in range(0, len(records), 500):
+            batch = records[i:i+500]
+            payload = {"records": [
+                {"record_id": record_id, "fields": fields} for record_id, fields in batch
+            ]}
+
+            data = self._request("POST", url, json=payload)
+
+            if data.get("code") == 0:
+                results.extend([True] * len(batch))
+            else:
+                print(f"   ⚠ 批量更新记录失败: {data.get('msg', data)}")
+                results.extend([False] * len(batch))
+
+        return results
+
     # ==================== 读取功能 ====================
 
-    def list_records(self, table_key: str, page_size: int = 100, filter_status: str = None) -> List[dict]:
-        """获取数据表的所有记录"""
+    def list_records(self, table_key: str, page_size: int = 100, filter_status: str = None) -> Optional[List[dict]]:
+        """获取数据表的所有记录；拉取失败时返回 None（不完整的结果不能当作整张表）"""
         table_id = self.table_ids.get(table_key)
         if not table_id:
             self.get_all_table_ids()
             table_id = self.table_ids.get(table_key)
 
         if not table_id:
-            return []
+            print(f"   ✗ 找不到数据表: {table_key}")
+            return None
 
         url = f"{self.BASE_URL}/bitable/v1/apps/{self.bitable_token}/tables/{table_id}/records"
         params = {"page_size": page_size}
@@ -326,11 +546,11 @@ class FeishuSync:
             if page_token:
                 params["page_token"] = page_token
 
-            resp = requests.get(url, headers=self._headers(), params=params)
-            data = resp.json()
+            data = self._request("GET", url, params=params)
 
             if data.get("code") != 0:
-                break
+                print(f"   ⚠ 拉取记录失败: {data.get('msg', data)}")
+                return None
 
             items = data.get("data", {}).get("items", [])
             for item in items:
@@ -352,11 +572,11 @@ class FeishuSync:
 
     def get_pending_threads(self) -> List[dict]:
         """获取所有待处理的线头"""
-        return self.list_records("threads", filter_status="待处理")
+        return self.list_records("threads", filter_status="待处理") or []
 
     def get_recent_archives(self, limit: int = 5) -> List[dict]:
         """获取最近的对话归档"""
-        records = self.list_records("archives")
+        records = self.list_records("archives") or []
         # 按日期排序，取最近的
         records.sort(key=lambda x: x.get("日期", 0), reverse=True)
         return records[:limit]
@@ -438,8 +658,7 @@ class FeishuSync:
             "title": title
         }
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
-        data = resp.json()
+        data = self._request("POST", url, json=payload)
 
         if data.get("code") == 0:
             document_id = data["data"]["document"]["document_id"]
@@ -456,12 +675,18 @@ class FeishuSync:
 
         batch_url = f"{self.BASE_URL}/docx/v1/documents/{document_id}/blocks/{document_id}/children"
 
+        # 按顺序追加（每次最多50块）：并发插入时后一批可能先到，
+        # 指定的 index 会越界或打乱段落顺序，所以这里保持串行
         for i in range(0, len(blocks), 50):
             batch = blocks[i:i+50]
-            requests.post(batch_url, headers=self._headers(), json={
+            data = self._request("POST", batch_url, json={
                 "children": batch,
                 "index": -1
             })
+            if data.get("code") != 0:
+                # 后续批次再追加会造成内容缺段，直接停止
+                print(f"   ⚠ 写入文档内容失败（第 {i + 1} 块起）: {data.get('msg', data)}")
+                return
 
     def _markdown_to_blocks(self, markdown: str) -> list:
         """将Markdown转换为飞书文档块
@@ -483,18 +708,19 @@ class FeishuSync:
 
         while i < len(lines):
             line = lines[i]
+            ls = line.strip()
+            i += 1
 
-            if not line.strip():
-                i += 1
+            if not ls:
                 continue
 
             # 代码块
-            if line.strip().startswith('```'):
+            if ls.startswith('```'):
                 code_lines = []
-                i += 1
                 while i < len(lines) and not lines[i].strip().startswith('```'):
                     code_lines.append(lines[i])
                     i += 1
+                i += 1
                 code_content = '\n'.join(code_lines)
                 if code_content.strip():
                     blocks.append({
@@ -504,78 +730,122 @@ class FeishuSync:
                             "language": 1
                         }
                     })
-                i += 1
                 continue
 
-            # 标题
-            if line.startswith('# '):
-                text = line[2:].strip()
-                if text:
-                    blocks.append({"block_type": 3, "heading1": {"elements": [{"text_run": {"content": text}}]}})
-            elif line.startswith('## '):
-                text = line[3:].strip()
-                if text:
-                    blocks.append({"block_type": 4, "heading2": {"elements": [{"text_run": {"content": text}}]}})
-            elif line.startswith('### '):
-                text = line[4:].strip()
-                if text:
-                    blocks.append({"block_type": 5, "heading3": {"elements": [{"text_run": {"content": text}}]}})
-            # 无序列表
-            elif line.strip().startswith('- ') or line.strip().startswith('* '):
-                content = line.strip()[2:].strip()
-                # 处理 checkbox
-                if content.startswith('[ ]') or content.startswith('[x]'):
-                    content = content[3:].strip()
-                if content:
-                    blocks.append({"block_type": 12, "bullet": {"elements": [{"text_run": {"content": content}}]}})
-            # 有序列表
-            elif line.strip() and line.strip()[0].isdigit() and '. ' in line:
-                content = line.split('. ', 1)[1].strip() if '. ' in line else line.strip()
-                if content:
-                    blocks.append({"block_type": 13, "ordered": {"elements": [{"text_run": {"content": content}}]}})
-            # 引用
-            elif line.strip().startswith('> '):
-                content = line.strip()[2:].strip()
-                if content:
-                    blocks.append({"block_type": 19, "quote": {"elements": [{"text_run": {"content": content}}]}})
-            # 分割线
-            elif line.strip() in ['---', '***', '___']:
-                blocks.append({"block_type": 22, "divider": {}})
+            # 标题（只认行首的 #、##、###）
+            if line[:1] == '#':
+                level = len(line) - len(line.lstrip('#'))
+                if level in HEADING_BLOCKS and line[level:level + 1] == ' ':
+                    text = line[level + 1:].strip()
+                    if text:
+                        block_type, key = HEADING_BLOCKS[level]
+                        blocks.append(_docx_block(block_type, key, text))
+                    continue
+
+            # 按首字符分派，避免对每行依次尝试所有规则
+            first = ls[:1]
+            if first in ('-', '*'):
+                # 无序列表
+                if ls[1:2] == ' ':
+                    content = ls[2:].strip()
+                    # 处理 checkbox
+                    if content.startswith(('[ ]', '[x]')):
+                        content = content[3:].strip()
+                    if content:
+                        blocks.append(_docx_block(12, "bullet", content))
+                    continue
+                # 分割线
+                if ls in DIVIDERS:
+                    blocks.append({"block_type": 22, "divider": {}})
+                    continue
+            elif first.isdigit():
+                # 有序列表
+                if '. ' in line:
+                    content = line.split('. ', 1)[1].strip()
+                    if content:
+                        blocks.append(_docx_block(13, "ordered", content))
+                    continue
+            elif first == '>':
+                # 引用
+                if ls.startswith('> '):
+                    content = ls[2:].strip()
+                    if content:
+                        blocks.append(_docx_block(19, "quote", content))
+                    continue
+            elif first == '_':
+                # 分割线
+                if ls in DIVIDERS:
+                    blocks.append({"block_type": 22, "divider": {}})
+                    continue
+
             # 表格行 - 转为普通文本
-            elif '|' in line.strip():
+            if '|' in ls:
                 # 跳过表格分隔行
-                if line.strip().replace('|', '').replace('-', '').replace(' ', '') == '':
-                    pass
-                else:
+                if ls.replace('|', '').replace('-', '').replace(' ', ''):
                     # 表格内容转为文本
-                    cells = [c.strip() for c in line.strip().split('|') if c.strip()]
+                    cells = [c.strip() for c in ls.split('|') if c.strip()]
                     if cells:
-                        blocks.append({"block_type": 2, "text": {"elements": [{"text_run": {"content": ' | '.join(cells)}}]}})
+                        blocks.append(_docx_block(2, "text", ' | '.join(cells)))
             # 普通文本
-            elif line.strip():
-                blocks.append({"block_type": 2, "text": {"elements": [{"text_run": {"content": line.strip()}}]}})
-
-            i += 1
+            else:
+                blocks.append(_docx_block(2, "text", ls))
 
         return blocks
 
 
+def _docx_block(block_type: int, key: str, content: str) -> dict:
+    """构造只含一段文本的飞书文档块"""
+    return {"block_type": block_type, key: {"elements": [{"text_run": {"content": content}}]}}
+
+
 # ==================== 解析函数 ====================
 
+# 解析用正则（模块级编译一次，避免逐行重复查缓存/编译）
+SOURCE_RE = re.compile(r'[（(]来自[：:]?\s*(.+?)[）)]')
+SOURCE_STRIP_RE = re.compile(r'[（(]来自.+?[）)]')
+DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+TAG_RE = re.compile(r'#([^\s#]+)')  # 匹配 # 后的非空白非#字符
+NUM_PREFIX_RE = re.compile(r'^\d+\.\s*')
+FILENAME_DATE_RE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+PENDING_TODO_RE = re.compile(r'^[^\S\n]*- \[ \]', re.M)  # 未完成的 checkbox（允许缩进）
+# 线头文件行类型：一次匹配完成分类，分支顺序即判断优先级
+THREAD_LINE_RE = re.compile(
+    r'(?P<heading>## )'                                            # 分类标题
+    r'|(?P<table_header>(?=.*\|)(?=.*(?:日期|事项|想法|假设|问题)))'  # 表格头（含 | 和表头关键字）
+    r'|(?P<table_sep>\|.*---)'                                     # 表格分隔行
+    r'|(?P<table_row>\|)'                                          # 表格数据行
+    r'|(?P<checkbox>- \[[ x]\])'                                   # checkbox 条目
+)
+# 项目状态文件：项目标题（跳过"自动/主动"开头的说明段落）和 "- **" 属性行
+PROJECT_LINE_RE = re.compile(
+    r'^[ \t]*## (?!自动|主动)(?P<name>[^\n]*\S)'
+    r'|^[ \t]*(?P<attr>- \*\*[^\n]*)',
+    re.M,
+)
+# 项目属性：(行内关键字, 字段名, 取值正则)，顺序即判断优先级
+PROJECT_ATTRS = tuple(
+    (keyword, field, re.compile(keyword + r'.*?：(.+)$'))
+    for keyword, field in (("状态", "状态"), ("最近修改", "最近修改"), ("Git", "Git提交数"), ("待办", "待办"))
+)
+
+
 def parse_threads_file(file_path: Path) -> List[dict]:
     """解析线头追踪文件，提取线头列表（支持表格和列表格式）"""
-    content = file_path.read_text(encoding="utf-8")
+    lines = file_path.read_text(encoding="utf-8").splitlines()
     threads = []
 
     current_category = "其他"
     in_table = False
     table_headers = []
 
-    for line in content.split('\n'):
+    for line in lines:
         line_stripped = line.strip()
 
+        match = THREAD_LINE_RE.match(line_stripped)
+        kind = match.lastgroup if match else None
+
         # 识别分类标题
-        if line_stripped.startswith('## '):
+        if kind == "heading":
             category = line_stripped[3:].strip()
             if '待跟进' in category:
                 current_category = "待跟进事项"
@@ -593,17 +863,17 @@ def parse_threads_file(file_path: Path) -> List[dict]:
             table_headers = []
 
         # 识别表格头
-        elif '|' in line_stripped and ('日期' in line_stripped or '事项' in line_stripped or '想法' in line_stripped or '假设' in line_stripped or '问题' in line_stripped):
+        elif kind == "table_header":
             in_table = True
             # 解析表头
             table_headers = [h.strip() for h in line_stripped.split('|') if h.strip()]
 
         # 跳过表格分隔行
-        elif line_stripped.startswith('|') and '---' in line_stripped:
+        elif kind == "table_sep":
             continue
 
         # 解析表格数据行
-        elif in_table and line_stripped.startswith('|') and '|' in line_stripped:
+        elif in_table and kind == "table_row":
             cells = [c.strip() for c in line_stripped.split('|') if c.strip()]
             if len(cells) >= 2 and cells[0] and cells[1]:  # 至少有日期和内容
                 # 跳过空行
@@ -638,7 +908,7 @@ def parse_threads_file(file_path: Path) -> List[dict]:
                 })
 
         # 识别 checkbox 格式的线头条目
-        elif line_stripped.startswith('- [ ]') or line_stripped.startswith('- [x]'):
+        elif kind == "checkbox":
             is_done = line_stripped.startswith('- [x]')
             item_content = line_stripped[5:].strip()
 
@@ -646,10 +916,10 @@ def parse_threads_file(file_path: Path) -> List[dict]:
             source = ""
 
             if '（来自' in item_content or '(来自' in item_content:
-                match = re.search(r'[（(]来自[：:]?\s*(.+?)[）)]', item_content)
+                match = SOURCE_RE.search(item_content)
                 if match:
                     source = match.group(1)
-                    title = re.sub(r'[（(]来自.+?[）)]', '', item_content).strip()
+                    title = SOURCE_STRIP_RE.sub('', item_content).strip()
 
             threads.append({
                 "标题": title,
@@ -664,10 +934,20 @@ def parse_threads_file(file_path: Path) -> List[dict]:
     return threads
 
 
-def parse_archive_file(file_path: Path) -> dict:
-    """解析对话归档文件，提取元信息"""
-    content = file_path.read_text(encoding="utf-8")
+def parse_archive_file(file_path: Path, content: Optional[str] = None) -> dict:
+    """解析对话归档文件，提取元信息（调用方已读入内容时可传 content，避免重复读文件）"""
+    if content is None:
+        # 逐行流式读取，不把整个文件载入内存
+        with open(file_path, encoding="utf-8") as f:
+            return _parse_archive_lines(file_path, f)
+    result = _parse_archive_lines(file_path, content.splitlines(), count_pending=False)
+    # 已有完整内容时一次正则扫描统计待跟进数，不在逐行循环里累加
+    result["待跟进数"] = len(PENDING_TODO_RE.findall(content))
+    return result
+
 
+def _parse_archive_lines(file_path: Path, lines, count_pending: bool = True) -> dict:
+    """从逐行内容中提取归档元信息"""
     result = {
         "日期": None,
         "主题": file_path.stem,
@@ -677,7 +957,6 @@ def parse_archive_file(file_path: Path) -> dict:
         "待跟进数": 0
     }
 
-    lines = content.split('\n')
     in_summary = False
     in_insights = False
     insights = []
@@ -687,13 +966,13 @@ def parse_archive_file(file_path: Path) -> dict:
 
         # 提取日期
         if line_stripped.startswith('**日期**') or line_stripped.startswith('日期：'):
-            date_match = re.search(r'(\d{4}-\d{2}-\d{2})', line)
+            date_match = DATE_RE.search(line)
             if date_match:
                 result["日期"] = date_match.group(1)
 
         # 提取标签 - 只匹配包含"标签"的行，避免匹配普通标题
         if '标签' in line and '#' in line:
-            tags = re.findall(r'#([^\s#]+)', line)  # 匹配 # 后的非空白非#字符
+            tags = TAG_RE.findall(line)
             if tags:
                 result["标签"] = tags
 
@@ -719,19 +998,19 @@ def parse_archive_file(file_path: Path) -> dict:
                 # 提取洞见标题，去掉序号
                 insight_text = line_stripped[3:].strip()
                 # 移除开头的数字和点
-                insight_text = re.sub(r'^\d+\.\s*', '', insight_text)
+                insight_text = NUM_PREFIX_RE.sub('', insight_text)
                 if insight_text:
                     insights.append(insight_text)
 
-        # 统计待跟进数
-        if line_stripped.startswith('- [ ]'):
+        # 统计待跟进数（流式读取时只能逐行累加）
+        if count_pending and line_stripped.startswith('- [ ]'):
             result["待跟进数"] += 1
 
     result["核心洞见"] = '\n'.join(insights[:3])  # 最多3条
 
     # 如果没有日期，从文件名提取
     if not result["日期"]:
-        date_match = re.search(r'(\d{4})-?(\d{2})-?(\d{2})', file_path.stem)
+        date_match = FILENAME_DATE_RE.search(file_path.stem)
         if date_match:
             result["日期"] = f"{date_match.group(1)}-{date_match.group(2)}-{date_match.group(3)}"
         else:
@@ -747,39 +1026,31 @@ def parse_projects_file(file_path: Path) -> List[dict]:
 
     current_project = None
 
-    for line in content.split('\n'):
-        line_stripped = line.strip()
+    # 一次扫描整个文件，只取出项目标题行和属性行
+    for match in PROJECT_LINE_RE.finditer(content):
+        name = match.group("name")
 
         # 识别项目标题
-        if line_stripped.startswith('## ') and not line_stripped.startswith('## 自动') and not line_stripped.startswith('## 主动'):
+        if name is not None:
             if current_project:
                 projects.append(current_project)
             current_project = {
-                "项目名": line_stripped[3:].strip(),
+                "项目名": name.strip(),
                 "状态": "-",
                 "最近修改": "-",
                 "Git提交数": "-",
                 "待办": "无"
             }
 
-        # 解析项目属性
-        elif current_project and line_stripped.startswith('- **'):
-            if '状态' in line_stripped:
-                match = re.search(r'状态.*?：(.+)$', line_stripped)
-                if match:
-                    current_project["状态"] = match.group(1).strip()
-            elif '最近修改' in line_stripped:
-                match = re.search(r'最近修改.*?：(.+)$', line_stripped)
-                if match:
-                    current_project["最近修改"] = match.group(1).strip()
-            elif 'Git' in line_stripped:
-                match = re.search(r'Git.*?：(.+)$', line_stripped)
-                if match:
-                    current_project["Git提交数"] = match.group(1).strip()
-            elif '待办' in line_stripped:
-                match = re.search(r'待办.*?：(.+)$', line_stripped)
-                if match:
-                    current_project["待办"] = match.group(1).strip()
+        # 解析项目属性（按关键字优先级取第一个出现在行内的）
+        elif current_project:
+            attr = match.group("attr")
+            for keyword, field, value_re in PROJECT_ATTRS:
+                if keyword in attr:
+                    value = value_re.search(attr.strip())
+                    if value:
+                        current_project[field] = value.group(1).strip()
+                    break
 
     # 添加最后一个项目
     if current_project:
@@ -791,20 +1062,48 @@ def parse_projects_file(file_path: Path) -> List[dict]:
 # ==================== 同步函数 ====================
 
 def date_to_timestamp(date_str: str) -> int:
-    """将日期字符串转换为毫秒时间戳"""
+    """将日期字符串转换为毫秒时间戳（无法解析时取当前时间）"""
     try:
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        return int(dt.timestamp() * 1000)
-    except:
+        return _parse_date_ms(date_str)
+    except Exception:
         return int(datetime.now().timestamp() * 1000)
 
 
-def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: str = None) -> bool:
-    """同步数据到飞书多维表格"""
+@lru_cache(maxsize=4096)
+def _parse_date_ms(date_str: str) -> int:
+    """解析 YYYY-MM-DD 为本地时间零点的毫秒时间戳（同一日期只解析一次）"""
+    y, m, d = date_str[:4], date_str[5:7], date_str[8:10]
+    if len(date_str) == 10 and date_str[4] == date_str[7] == '-' and y.isdigit() and m.isdigit() and d.isdigit():
+        dt = datetime(int(y), int(m), int(d))
+    else:
+        # 非标准写法（如 2024-1-5）交给 strptime
+        dt = datetime.strptime(date_str, "%Y-%m-%d")
+    return int(dt.timestamp() * 1000)
+
+
+# content_type -> (数据表key, 查重字段)
+SYNC_TABLES = {
+    "thread": ("threads", "标题"),
+    "archive": ("archives", "主题"),
+    "knowledge": ("knowledge", "标题"),
+    "project": ("projects", "项目名"),
+    "followup": ("followups", "事项"),
+}
+
+
+# 每次同步都会取当前时间的字段，不参与内容是否变化的判断
+VOLATILE_FIELDS = {
+    "knowledge": ("创建时间",),
+    "project": ("更新时间",),
+}
+
+
+def build_fields(content_type: str, data: dict, doc_url: str = None) -> Optional[dict]:
+    """将解析结果转换为多维表格字段"""
 
     if content_type == "thread":
         # 转换日期格式
-        fields = {
+        return {
             "标题": data["标题"],
             "分类": data["分类"],
             "状态": data["状态"],
@@ -814,14 +1113,6 @@ def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: s
             "创建时间": date_to_timestamp(data.get("创建时间", datetime.now().strftime("%Y-%m-%d")))
         }
 
-        # 检查是否已存在
-        existing = syncer.search_record("threads", "标题", data["标题"])
-        if existing:
-            syncer.update_record("threads", existing["record_id"], fields)
-            return True
-        else:
-            return syncer.add_record("threads", fields) is not None
-
     elif content_type == "archive":
         fields = {
             "日期": date_to_timestamp(data["日期"]),
@@ -834,14 +1125,7 @@ def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: s
             fields["标签"] = data["标签"]
         if doc_url:
             fields["详情链接"] = {"link": doc_url, "text": "查看详情"}
-
-        # 检查是否已存在
-        existing = syncer.search_record("archives", "主题", data["主题"])
-        if existing:
-            syncer.update_record("archives", existing["record_id"], fields)
-            return True
-        else:
-            return syncer.add_record("archives", fields) is not None
+        return fields
 
     elif content_type == "knowledge":
         fields = {
@@ -852,16 +1136,10 @@ def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: s
         }
         if doc_url:
             fields["详情链接"] = {"link": doc_url, "text": "查看详情"}
-
-        existing = syncer.search_record("knowledge", "标题", data["标题"])
-        if existing:
-            syncer.update_record("knowledge", existing["record_id"], fields)
-            return True
-        else:
-            return syncer.add_record("knowledge", fields) is not None
+        return fields
 
     elif content_type == "project":
-        fields = {
+        return {
             "项目名": data["项目名"],
             "状态": data["状态"],
             "最近修改": data["最近修改"],
@@ -870,15 +1148,8 @@ def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: s
             "更新时间": int(datetime.now().timestamp() * 1000),
         }
 
-        existing = syncer.search_record("projects", "项目名", data["项目名"])
-        if existing:
-            syncer.update_record("projects", existing["record_id"], fields)
-            return True
-        else:
-            return syncer.add_record("projects", fields) is not None
-
     elif content_type == "followup":
-        fields = {
+        return {
             "人员": data["人员"],
             "事项": data["事项"],
             "来源日期": date_to_timestamp(data.get("来源日期", datetime.now().strftime("%Y-%m-%d"))),
@@ -886,15 +1157,150 @@ def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: s
             "备注": data.get("备注", ""),
         }
 
-        # 检查是否已存在（同一人员+同一事项）
-        existing = syncer.search_record("followups", "事项", data["事项"])
-        if existing and existing.get("fields", {}).get("人员") == data["人员"]:
-            syncer.update_record("followups", existing["record_id"], fields)
-            return True
-        else:
-            return syncer.add_record("followups", fields) is not None
+    return None
+
+
+def fields_hash(content_type: str, fields: dict) -> str:
+    """字段内容哈希（不含每次同步都会变的时间戳字段）"""
+    volatile = VOLATILE_FIELDS.get(content_type, ())
+    stable = {name: value for name, value in fields.items() if name not in volatile}
+    return hashlib.sha1(json.dumps(stable, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _find_existing(syncer: FeishuSync, content_type: str, data: dict) -> Optional[dict]:
+    """查找已存在的记录（跟进事项需同一人员+同一事项）"""
+    table_key, key_field = SYNC_TABLES[content_type]
+    existing = syncer.load_index(table_key, key_field).get(data[key_field])
+    if existing and content_type == "followup" and existing.get("fields", {}).get("人员") != data["人员"]:
+        return None
+    return existing
+
+
+def _upsert(syncer: FeishuSync, content_type: str, data: dict, existing: Optional[dict], doc_url: str = None) -> bool:
+    """已存在则更新，否则新增"""
+    fields = build_fields(content_type, data, doc_url)
+    if fields is None:
+        return False
+
+    table_key, key_field = SYNC_TABLES[content_type]
+    key = _record_key(content_type, data)
+    digest = fields_hash(content_type, fields)
+    if existing:
+        # 与上次写入的内容一致，不必再更新
+        if syncer.synced_hash(table_key, key) != digest:
+            if syncer.update_record(table_key, existing["record_id"], fields):
+                syncer.remember_hashes(table_key, {key: digest})
+        return True
+
+    record_id = syncer.add_record(table_key, fields)
+    if record_id is None:
+        return False
+    syncer.remember_record(table_key, key_field, record_id, fields)
+    syncer.remember_hashes(table_key, {key: digest})
+    return True
+
 
-    return False
+def sync_to_feishu(syncer: FeishuSync, content_type: str, data: dict, doc_url: str = None) -> bool:
+    """同步数据到飞书多维表格"""
+    if content_type not in SYNC_TABLES:
+        return False
+
+    # 检查是否已存在（同一查重键的查找与新增整体加锁）
+    table_key, _ = SYNC_TABLES[content_type]
+    with syncer.key_lock(table_key, _record_key(content_type, data)):
+        existing = _find_existing(syncer, content_type, data)
+        return _upsert(syncer, content_type, data, existing, doc_url)
+
+
+def sync_with_document(syncer: FeishuSync, content_type: str, data: dict, title: str, content: str) -> bool:
+    """创建详情文档并同步索引记录
+
+    创建文档与查找已有记录互不依赖，两者并发进行，拿到文档链接后再写记录；
+    同一查重键的查找与新增整体加锁，并发同步同名文件时不会重复新增
+    """
+    if content_type not in SYNC_TABLES:
+        return False
+
+    table_key, _ = SYNC_TABLES[content_type]
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        doc_future = pool.submit(syncer.create_document, title, content)
+        with syncer.key_lock(table_key, _record_key(content_type, data)):
+            existing = _find_existing(syncer, content_type, data)
+            doc_url = doc_future.result()
+            return _upsert(syncer, content_type, data, existing, doc_url)
+
+
+def _record_key(content_type: str, data: dict):
+    """记录的查重键（跟进事项需同一人员+同一事项）"""
+    _, key_field = SYNC_TABLES[content_type]
+    if content_type == "followup":
+        return (data.get(key_field), data.get("人员"))
+    return data.get(key_field)
+
+
+def sync_to_feishu_batch(syncer: FeishuSync, content_type: str, items: List[dict]) -> List[bool]:
+    """批量同步同一类型的多条数据
+
+    先一次拉取表中已有记录做比对：新增合并为 batch_create，有变化的合并为
+    batch_update，内容未变的记录不发请求。返回与 items 顺序一致的成功标记
+    """
+    if content_type not in SYNC_TABLES:
+        return [False] * len(items)
+
+    table_key, _ = SYNC_TABLES[content_type]
+    results = [False] * len(items)
+
+    records = syncer.list_records(table_key, page_size=500)
+    if records is None:
+        # 拉不到完整的已有记录时无法查重，不写入任何记录，避免整表重复新增
+        return results
+
+    # 表中已有记录：查重键 -> 记录（重复时取第一条，与 search_record 一致）
+    existing = {}
+    for record in records:
+        existing.setdefault(_record_key(content_type, record), record)
+
+    # 查重键 -> (字段, 对应的 items 下标)
+    # 同一批里重复的键只写一次，以最后出现的内容为准（与逐条同步时"先建后改"一致）
+    pending = {}
+    for i, data in enumerate(items):
+        key = _record_key(content_type, data)
+        indexes = pending[key][1] if key in pending else []
+        pending[key] = (build_fields(content_type, data), indexes + [i])
+
+    to_create, to_update = [], []
+    written = {}  # 写入成功的记录：查重键 -> 字段哈希
+    for key, (fields, indexes) in pending.items():
+        record = existing.get(key)
+        digest = fields_hash(content_type, fields)
+        if record is None:
+            to_create.append((key, digest, fields, indexes))
+        elif (syncer.synced_hash(table_key, key) == digest
+              or all(record.get(name) == value for name, value in fields.items())):
+            # 内容未变化（与上次写入的哈希一致，或与表中现有值相同），无需更新
+            for i in indexes:
+                results[i] = True
+        else:
+            to_update.append((key, digest, (record["_record_id"], fields), indexes))
+
+    if to_create:
+        record_ids = syncer.batch_add_records(table_key, [fields for _, _, fields, _ in to_create])
+        for (key, digest, _, indexes), record_id in zip(to_create, record_ids):
+            for i in indexes:
+                results[i] = record_id is not None
+            if record_id is not None:
+                written[key] = digest
+
+    if to_update:
+        updated = syncer.batch_update_records(table_key, [record for _, _, record, _ in to_update])
+        for (key, digest, _, indexes), ok in zip(to_update, updated):
+            for i in indexes:
+                results[i] = ok
+            if ok:
+                written[key] = digest
+
+    syncer.remember_hashes(table_key, written)
+    return results
 
 
 # ==================== 测试入口 ====================
@@ -2,13 +2,69 @@
 Notion同步模块
 将知识管理系统的内容同步到Notion数据库
 """
+import hashlib
 import json
 import re
+import sys
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Iterator, Optional, Dict, List
 from config import NOTION_API_KEY, NOTION_DATABASE_ID
+from feishu_cache import CACHE_DIR, read_cache, write_cache
+from rate_limiter import RateLimiter, backoff_delay
+
+# 请求超时：(连接超时, 读取超时) 秒
+REQUEST_TIMEOUT = (3.05, 30)
+# Notion 限速按每秒计（约 3 次/秒），不是 15 分钟内的平均值；所有 NotionSync 实例共享
+NOTION_LIMITER = RateLimiter(rate=3, burst=3)
+# 被限流（429）后最多重试次数
+RATE_LIMIT_RETRIES = 3
+# 标题 -> 页面ID 缓存（与飞书缓存同目录），超过有效期重新查询
+TITLES_CACHE_FILE = CACHE_DIR / "notion_titles.json"
+TITLE_CACHE_TTL = 3600
+# 各文件上次同步的内容指纹和页面URL，内容未变化时跳过同步
+NOTION_STATE_FILE = CACHE_DIR / "notion_sync_state.json"
+# 批量查重时每次 or 过滤的标题数
+TITLE_QUERY_CHUNK = 100
+# 批量同步时并发处理的文件数（实际请求速率仍由 NOTION_LIMITER 控制）
+SYNC_WORKERS = 3
+
+# 单次请求最多携带的子块数
+MAX_CHILDREN = 100
+# 单段 rich_text 的最大字符数
+RICH_TEXT_LIMIT = 2000
+
+# Markdown 行解析
+DIVIDERS = frozenset(('---', '***', '___'))
+_RE_OL = re.compile(r'(\d+)\. (.*)')          # 有序列表
+_RE_TASK = re.compile(r'- \[([ x])\] (.*)')    # 待办事项
+
+# 笔记元信息：日期、一句话总结、主题标签
+META_RE = re.compile(
+    r'\*\*日期\*\*[：:]\s*(?P<date>\d{4}-\d{2}-\d{2})'
+    r'|## 一句话总结\n+(?=(?P<summary>.+))'  # 先行断言：总结行不被占用，其中的日期/标签仍能匹配
+    r'|\*\*主题标签\*\*[：:]\s*(?P<tags>.+)'
+)
+
+
+def _new_session(headers: dict) -> requests.Session:
+    """创建带连接池和重试的 Session（keep-alive 复用 TLS 连接）"""
+    session = requests.Session()
+    session.headers.update(headers)
+    # 429 不在这里重试：交给 NotionSync._request，重试时同样经过限流器
+    # 只重试幂等请求：POST 建页面 / PATCH 追加块没有幂等键，重发可能产生重复页面或重复内容
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504],
+                  allowed_methods=["GET", "DELETE"])
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
 
 class NotionSync:
     """Notion同步器"""
@@ -19,6 +75,10 @@ class NotionSync:
     def __init__(self):
         self.api_key = NOTION_API_KEY
         self.database_id = NOTION_DATABASE_ID
+        # 复用连接，鉴权等公共请求头只设置一次
+        self.session = _new_session(self._headers())
+        self.title_cache = None  # 首次查找时从本地缓存加载
+        self._cache_lock = threading.Lock()
 
     def _headers(self) -> dict:
         return {
@@ -27,6 +87,28 @@ class NotionSync:
             "Notion-Version": self.VERSION
         }
 
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """限流后发送请求；被限流（429）时按 Retry-After 退避重试"""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            with NOTION_LIMITER:
+                resp = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+            if resp.status_code != 429:
+                return resp
+            if attempt < RATE_LIMIT_RETRIES:
+                time.sleep(backoff_delay(attempt, resp.headers.get("Retry-After"), base=1.0, cap=60.0))
+        return resp
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
     def create_page(self, title: str, content: str, tags: List[str] = None,
                     date: str = None, summary: str = None) -> Optional[str]:
         """
@@ -57,7 +139,7 @@ class NotionSync:
         if tags:
             properties["标签"] = {"multi_select": [{"name": tag} for tag in tags]}
         if summary:
-            properties["摘要"] = {"rich_text": [{"text": {"content": summary[:2000]}}]}
+            properties["摘要"] = {"rich_text": [{"text": {"content": summary[:RICH_TEXT_LIMIT]}}]}
 
         # 转换内容为Notion块
         children = self._markdown_to_blocks(content)
@@ -65,185 +147,287 @@ class NotionSync:
         payload = {
             "parent": {"database_id": self.database_id},
             "properties": properties,
-            "children": children[:100]  # Notion限制100个块
+            "children": children[:MAX_CHILDREN]  # 创建时最多100个块，其余随后追加
         }
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
+        resp = self._request("POST", url, json=payload)
         data = resp.json()
 
         if "id" in data:
+            if len(children) > MAX_CHILDREN and not self._append_blocks(data["id"], children[MAX_CHILDREN:]):
+                # 内容不完整的页面不保留，避免与旧页面并存
+                self.archive_page(data["id"])
+                _log(f"❌ 创建Notion页面失败（内容追加不完整）: {title}")
+                return None
+            self._remember_title(title, data["id"])
             page_url = data.get("url", f"https://notion.so/{data['id'].replace('-', '')}")
-            print(f"✅ Notion页面已创建: {title}")
+            _log(f"✅ Notion页面已创建: {title}")
             return page_url
         else:
-            print(f"❌ 创建Notion页面失败: {data}")
+            _log(f"❌ 创建Notion页面失败: {data}")
             return None
 
-    def query_database(self, filter_dict: dict = None) -> List[dict]:
-        """查询数据库"""
+    def query_database(self, filter_dict: dict = None, properties: List[str] = None,
+                       page_size: int = None) -> List[dict]:
+        """查询数据库（properties 为只返回的属性ID列表，减少传输量）"""
         url = f"{self.BASE_URL}/databases/{self.database_id}/query"
         payload = {}
         if filter_dict:
             payload["filter"] = filter_dict
+        if page_size:
+            payload["page_size"] = page_size
+        params = [("filter_properties", prop) for prop in properties] if properties else None
 
-        resp = requests.post(url, headers=self._headers(), json=payload)
+        resp = self._request("POST", url, params=params, json=payload)
         data = resp.json()
         return data.get("results", [])
 
+    def _title_key(self, title: str) -> str:
+        """标题缓存的键（区分不同数据库）"""
+        return json.dumps([self.database_id, title], ensure_ascii=False)
+
+    def _remember_title(self, title: str, page_id: Optional[str]):
+        """记录或移除（page_id 为 None）标题对应的页面，并保存到本地缓存"""
+        self._remember_titles({title: page_id})
+
+    def _remember_titles(self, pages: Dict[str, Optional[str]]):
+        """批量记录 {标题: 页面ID}（页面ID 为 None 表示移除），只写一次本地缓存"""
+        with self._cache_lock:
+            if self.title_cache is None:
+                self.title_cache = read_cache(TITLES_CACHE_FILE)
+            now = time.time()
+            for title, page_id in pages.items():
+                key = self._title_key(title)
+                if page_id:
+                    self.title_cache[key] = {"page_id": page_id, "cached_at": now}
+                else:
+                    self.title_cache.pop(key, None)
+            write_cache(TITLES_CACHE_FILE, self.title_cache)
+
+    def _cached_page(self, title: str) -> Optional[str]:
+        """有效期内缓存的页面ID"""
+        with self._cache_lock:
+            if self.title_cache is None:
+                self.title_cache = read_cache(TITLES_CACHE_FILE)
+            cached = self.title_cache.get(self._title_key(title))
+        if cached and time.time() - cached["cached_at"] < TITLE_CACHE_TTL:
+            return cached["page_id"]
+        return None
+
     def find_page_by_title(self, title: str) -> Optional[str]:
-        """按标题查找页面"""
+        """按标题查找页面（优先使用有效期内的缓存）"""
+        cached = self._cached_page(title)
+        if cached:
+            return cached
+
+        # 只需要页面ID：标题属性的ID固定为 "title"，且只取第一条
         results = self.query_database({
             "property": "标题",
             "title": {"equals": title}
-        })
+        }, properties=["title"], page_size=1)
         if results:
+            self._remember_title(title, results[0]["id"])
             return results[0]["id"]
         return None
 
-    def update_page(self, page_id: str, content: str) -> bool:
-        """更新页面内容"""
-        # 先删除现有块
-        blocks_url = f"{self.BASE_URL}/blocks/{page_id}/children"
-        resp = requests.get(blocks_url, headers=self._headers())
-        existing_blocks = resp.json().get("results", [])
-
-        for block in existing_blocks:
-            delete_url = f"{self.BASE_URL}/blocks/{block['id']}"
-            requests.delete(delete_url, headers=self._headers())
-
-        # 添加新内容
-        new_blocks = self._markdown_to_blocks(content)
-        requests.patch(blocks_url, headers=self._headers(), json={
-            "children": new_blocks[:100]
-        })
+    def find_pages_by_titles(self, titles: List[str]) -> Dict[str, str]:
+        """批量按标题查找页面，返回 {标题: 页面ID}（未缓存的标题每100个合并成一次 or 查询）"""
+        found = {}
+        missing = []
+        for title in dict.fromkeys(titles):
+            cached = self._cached_page(title)
+            if cached:
+                found[title] = cached
+            else:
+                missing.append(title)
+
+        url = f"{self.BASE_URL}/databases/{self.database_id}/query"
+        fetched = {}
+        for i in range(0, len(missing), TITLE_QUERY_CHUNK):
+            chunk = missing[i:i + TITLE_QUERY_CHUNK]
+            payload = {
+                "filter": {"or": [{"property": "标题", "title": {"equals": t}} for t in chunk]},
+                "page_size": 100,
+            }
+            while True:
+                data = self._request("POST", url, params=[("filter_properties", "title")], json=payload).json()
+                for page in data.get("results", []):
+                    title = "".join(t.get("plain_text", "") for t in page["properties"]["标题"]["title"])
+                    # 同名页面取第一个，与 find_page_by_title 一致
+                    fetched.setdefault(title, page["id"])
+                if not data.get("has_more"):
+                    break
+                payload["start_cursor"] = data["next_cursor"]
+
+        if fetched:
+            self._remember_titles(fetched)
+        found.update(fetched)
+        return found
+
+    def upsert_page(self, title: str, content: str, tags: List[str] = None, date: str = None,
+                    summary: str = None, existing_page: Optional[str] = None,
+                    check_existing: bool = True) -> Optional[str]:
+        """
+        按标题创建或替换页面，返回页面URL
+
+        Notion 不限制标题唯一，直接创建无法通过冲突发现已有页面，因此先查重：
+        优先用标题缓存，命中时不发查询；批量同步已查过时传 existing_page 并设 check_existing=False
+        """
+        if check_existing and existing_page is None:
+            existing_page = self.find_page_by_title(title)
+
+        if existing_page:
+            _log(f"📝 更新已存在的页面: {title}")
+
+        # 先建新页面：1 次创建 + 1 次归档，不必逐个删除旧块；创建失败时旧页面原样保留
+        page_url = self.create_page(title, content, tags, date, summary)
+        if page_url and existing_page and not self.archive_page(existing_page):
+            _log(f"⚠️ 旧页面归档失败，需手动删除: {title} ({existing_page})")
+        return page_url
+
+    def archive_page(self, page_id: str) -> bool:
+        """归档页面（一次请求连同所有子块一起移除）"""
+        resp = self._request("PATCH", f"{self.BASE_URL}/pages/{page_id}", json={"archived": True})
+        if resp.status_code != 200:
+            return False
+        # 已归档的页面不再对应任何标题
+        with self._cache_lock:
+            if self.title_cache:
+                for key, cached in list(self.title_cache.items()):
+                    if cached["page_id"] == page_id:
+                        del self.title_cache[key]
+                write_cache(TITLES_CACHE_FILE, self.title_cache)
+        return True
+
+    def _append_blocks(self, block_id: str, blocks: List[dict]) -> bool:
+        """追加子块：每次请求最多100个，按顺序逐批发送（并发追加会打乱块的顺序）"""
+        url = f"{self.BASE_URL}/blocks/{block_id}/children"
+        for i in range(0, len(blocks), MAX_CHILDREN):
+            resp = self._request("PATCH", url, json={"children": blocks[i:i + MAX_CHILDREN]})
+            if resp.status_code != 200:
+                _log(f"⚠️ 追加内容失败（第{i + 1}块起）: {resp.text[:200]}")
+                return False
         return True
 
     def _markdown_to_blocks(self, markdown: str) -> List[dict]:
-        """
-        将Markdown转换为Notion块
+        """将Markdown转换为Notion块列表"""
+        return list(self._iter_blocks(markdown))
 
-        支持：标题、列表、代码块、引用、分割线、普通文本
+    def _iter_blocks(self, markdown: str) -> Iterator[dict]:
         """
-        blocks = []
-        lines = markdown.split('\n')
-        i = 0
+        逐行解析Markdown，依次生成Notion块（不预先切分出整个行列表）
 
-        while i < len(lines):
-            line = lines[i]
+        支持：标题、列表、待办、代码块、引用、分割线、表格、普通文本
+        """
+        lines = _iter_lines(markdown)
+        pending = None  # 表格结束时多读的一行，下一轮先处理
+
+        while True:
+            if pending is not None:
+                line, pending = pending, None
+            else:
+                line = next(lines, None)
+                if line is None:
+                    break
+            # 按首字符分派，每行只做少量判断
+            first = line[:1]
+            block = None
 
             # 代码块
-            if line.startswith('```'):
+            if first == '`' and line.startswith('```'):
                 lang = line[3:].strip() or "plain text"
                 code_lines = []
-                i += 1
-                while i < len(lines) and not lines[i].startswith('```'):
-                    code_lines.append(lines[i])
-                    i += 1
-                blocks.append({
-                    "object": "block",
-                    "type": "code",
-                    "code": {
-                        "rich_text": [{"type": "text", "text": {"content": '\n'.join(code_lines)}}],
-                        "language": lang
-                    }
-                })
-                i += 1
+                # 读到结束的 ``` 为止（结束行一并跳过）
+                for code_line in lines:
+                    if code_line.startswith('```'):
+                        break
+                    code_lines.append(code_line)
+                yield _text_block("code", '\n'.join(code_lines), language=lang)
                 continue
 
-            # 标题
-            if line.startswith('# '):
-                blocks.append({
-                    "object": "block",
-                    "type": "heading_1",
-                    "heading_1": {"rich_text": [{"type": "text", "text": {"content": line[2:]}}]}
-                })
-            elif line.startswith('## '):
-                blocks.append({
-                    "object": "block",
-                    "type": "heading_2",
-                    "heading_2": {"rich_text": [{"type": "text", "text": {"content": line[3:]}}]}
-                })
-            elif line.startswith('### '):
-                blocks.append({
-                    "object": "block",
-                    "type": "heading_3",
-                    "heading_3": {"rich_text": [{"type": "text", "text": {"content": line[4:]}}]}
-                })
-
-            # 无序列表
-            elif line.startswith('- ') or line.startswith('* '):
-                blocks.append({
-                    "object": "block",
-                    "type": "bulleted_list_item",
-                    "bulleted_list_item": {"rich_text": [{"type": "text", "text": {"content": line[2:]}}]}
-                })
+            # 标题（# / ## / ###）
+            if first == '#':
+                level = len(line) - len(line.lstrip('#'))
+                if level <= 3 and line[level:level + 1] == ' ':
+                    block = _text_block(f"heading_{level}", line[level + 1:])
+
+            # 待办事项（须先于无序列表判断）/ 无序列表
+            elif first == '-' or first == '*':
+                task = _RE_TASK.match(line) if first == '-' else None
+                if task:
+                    block = _text_block("to_do", task.group(2), checked=task.group(1) == 'x')
+                elif line[1:2] == ' ':
+                    block = _text_block("bulleted_list_item", line[2:])
 
             # 有序列表
-            elif re.match(r'^\d+\. ', line):
-                content = re.sub(r'^\d+\. ', '', line)
-                blocks.append({
-                    "object": "block",
-                    "type": "numbered_list_item",
-                    "numbered_list_item": {"rich_text": [{"type": "text", "text": {"content": content}}]}
-                })
-
-            # 待办事项
-            elif line.startswith('- [ ] ') or line.startswith('- [x] '):
-                checked = line.startswith('- [x] ')
-                content = line[6:]
-                blocks.append({
-                    "object": "block",
-                    "type": "to_do",
-                    "to_do": {
-                        "rich_text": [{"type": "text", "text": {"content": content}}],
-                        "checked": checked
-                    }
-                })
+            elif first.isdigit():
+                ordered = _RE_OL.match(line)
+                if ordered:
+                    block = _text_block("numbered_list_item", ordered.group(2))
 
             # 引用
-            elif line.startswith('> '):
-                blocks.append({
-                    "object": "block",
-                    "type": "quote",
-                    "quote": {"rich_text": [{"type": "text", "text": {"content": line[2:]}}]}
-                })
-
-            # 分割线
-            elif line.strip() in ['---', '***', '___']:
-                blocks.append({
-                    "object": "block",
-                    "type": "divider",
-                    "divider": {}
-                })
-
-            # 表格（简化处理，转为代码块）
-            elif '|' in line and line.strip().startswith('|'):
-                table_lines = [line]
-                i += 1
-                while i < len(lines) and '|' in lines[i]:
-                    table_lines.append(lines[i])
-                    i += 1
-                blocks.append({
-                    "object": "block",
-                    "type": "code",
-                    "code": {
-                        "rich_text": [{"type": "text", "text": {"content": '\n'.join(table_lines)}}],
-                        "language": "plain text"
-                    }
-                })
-                continue
-
-            # 普通段落
-            elif line.strip():
-                blocks.append({
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {"rich_text": [{"type": "text", "text": {"content": line}}]}
-                })
-
-            i += 1
-
-        return blocks
+            elif first == '>' and line[1:2] == ' ':
+                block = _text_block("quote", line[2:])
+
+            if block is None:
+                stripped = line.strip()
+
+                # 分割线
+                if stripped in DIVIDERS:
+                    block = {"object": "block", "type": "divider", "divider": {}}
+
+                # 表格（简化处理，转为代码块）
+                elif stripped.startswith('|'):
+                    table_lines = [line]
+                    for table_line in lines:
+                        if '|' not in table_line:
+                            pending = table_line
+                            break
+                        table_lines.append(table_line)
+                    yield _text_block("code", '\n'.join(table_lines), language="plain text")
+                    continue
+
+                # 普通段落
+                elif stripped:
+                    block = _text_block("paragraph", line)
+
+            if block is not None:
+                yield block
+
+
+_log_lock = threading.Lock()
+
+
+def _log(message: str):
+    """输出一行进度（整行一次写出并加锁，并发同步时各线程的输出不会交错）"""
+    with _log_lock:
+        sys.stdout.write(message + "\n")
+
+
+def _text_block(block_type: str, content: str, **extra) -> dict:
+    """构造只含一段文本的Notion块（extra 为该类型的其他字段，如 language / checked）"""
+    # 单段 rich_text 超过长度上限会导致整个请求被拒，超长内容拆成多段
+    rich_text = [
+        {"type": "text", "text": {"content": content[i:i + RICH_TEXT_LIMIT]}}
+        for i in range(0, len(content), RICH_TEXT_LIMIT)
+    ] if len(content) > RICH_TEXT_LIMIT else [{"type": "text", "text": {"content": content}}]
+    return {
+        "object": "block",
+        "type": block_type,
+        block_type: {"rich_text": rich_text, **extra}
+    }
+
+
+def _iter_lines(text: str) -> Iterator[str]:
+    """按 \\n 逐行产出（与 split('\\n') 结果相同，但不生成整个列表）"""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
 
 
 def sync_file_to_notion(file_path: Path, tags: List[str] = None) -> Optional[str]:
@@ -258,33 +442,129 @@ def sync_file_to_notion(file_path: Path, tags: List[str] = None) -> Optional[str
         Notion页面URL或None
     """
     if not NOTION_API_KEY or not NOTION_DATABASE_ID:
-        print("❌ 未配置Notion API凭据，跳过Notion同步")
+        _log("❌ 未配置Notion API凭据，跳过Notion同步")
         return None
 
-    syncer = NotionSync()
+    with NotionSync() as syncer:
+        state = read_cache(NOTION_STATE_FILE)
+        key = _state_key(syncer, file_path)
+        url, note, fingerprint = _check_note(state, key, file_path, tags)
+        if note is not None:
+            url = syncer.upsert_page(**note)
+            if url:
+                state[key] = dict(fingerprint, url=url)
+        write_cache(NOTION_STATE_FILE, state)
+        return url
 
-    title = file_path.stem
-    content = file_path.read_text(encoding="utf-8")
 
-    # 尝试从内容中提取元信息
-    date_match = re.search(r'\*\*日期\*\*[：:]\s*(\d{4}-\d{2}-\d{2})', content)
-    date = date_match.group(1) if date_match else datetime.now().strftime("%Y-%m-%d")
+def sync_files_to_notion(paths: List[Path], tags: List[str] = None) -> List[Optional[str]]:
+    """
+    批量同步Markdown文件到Notion（一次查重，并发创建/更新）
 
-    summary_match = re.search(r'## 一句话总结\n+(.+)', content)
-    summary = summary_match.group(1).strip() if summary_match else None
+    Returns:
+        与输入顺序一致的Notion页面URL列表（失败为None）
+    """
+    if not NOTION_API_KEY or not NOTION_DATABASE_ID:
+        _log("❌ 未配置Notion API凭据，跳过Notion同步")
+        return [None] * len(paths)
+
+    with NotionSync() as syncer, ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+        state = read_cache(NOTION_STATE_FILE)
+        keys = [_state_key(syncer, path) for path in paths]
+
+        def check_one(key, path):
+            try:
+                return _check_note(state, key, path, tags)
+            except OSError as e:
+                _log(f"❌ 读取失败 {path}: {e}")
+                return None, None, None
+
+        checked = list(pool.map(check_one, keys, paths))
+        # 只有内容变化的文件才需要查重和同步；同名文件对应同一页面，归为一组按顺序处理
+        groups = {}
+        for i, (_, note, _) in enumerate(checked):
+            if note is not None:
+                groups.setdefault(note["title"], []).append(i)
+        existing = syncer.find_pages_by_titles(list(groups))
+
+        def sync_group(indexes):
+            results = []
+            for n, i in enumerate(indexes):
+                note = checked[i][1]
+                try:
+                    if n == 0:
+                        # 组内第一个用批量查重的结果
+                        url = syncer.upsert_page(**note, existing_page=existing.get(note["title"]),
+                                                 check_existing=False)
+                    else:
+                        # 页面已被前一个文件替换，从标题缓存取新页面
+                        url = syncer.upsert_page(**note)
+                    results.append(url)
+                except requests.RequestException as e:
+                    _log(f"❌ 同步失败 {note['title']}: {e}")
+                    results.append(None)
+            return results
+
+        urls = [url for url, _, _ in checked]
+        for indexes, results in zip(groups.values(), pool.map(sync_group, groups.values())):
+            for i, url in zip(indexes, results):
+                urls[i] = url
+                if url:
+                    state[keys[i]] = dict(checked[i][2], url=url)
+        write_cache(NOTION_STATE_FILE, state)
+        return urls
+
+
+def _state_key(syncer: NotionSync, file_path: Path) -> str:
+    """同步状态的键（区分不同数据库）"""
+    return json.dumps([syncer.database_id, str(file_path.resolve())], ensure_ascii=False)
+
+
+def _check_note(state: dict, key: str, file_path: Path, tags: List[str] = None) -> tuple:
+    """
+    对比上次同步的指纹，返回 (url, note, fingerprint)
+
+    未变化时 note 为 None、url 为上次同步的页面；否则返回读好的 note 和新指纹，同步成功后写入状态
+    """
+    stat = file_path.stat()
+    entry = state.get(key)
+    if entry and entry.get("tags") != tags:
+        entry = None  # 指定的标签变了，需要重新同步
+
+    # 修改时间和大小都没变，不读文件
+    if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+        _log(f"⏭ 内容未变化，跳过: {file_path.stem}")
+        return entry["url"], None, None
+
+    note = _read_note(file_path, tags)
+    digest = hashlib.sha256(note["content"].encode("utf-8")).hexdigest()
+    if entry and entry["sha256"] == digest:
+        # 只是修改时间变了，记下新的时间，下次直接走快速路径
+        entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _log(f"⏭ 内容未变化，跳过: {file_path.stem}")
+        return entry["url"], None, None
+
+    return None, note, {"sha256": digest, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "tags": tags}
+
+
+def _read_note(file_path: Path, tags: List[str] = None) -> dict:
+    """读取文件并提取标题、日期、标签、摘要"""
+    title = file_path.stem
+    content = file_path.read_text(encoding="utf-8")
 
-    tag_match = re.search(r'\*\*主题标签\*\*[：:]\s*(.+)', content)
-    if tag_match and not tags:
-        tags = [t.strip().lstrip('#') for t in tag_match.group(1).split()]
+    # 尝试从内容中提取元信息（一次扫描，每项取第一次出现的值）
+    meta = {}
+    for match in META_RE.finditer(content):
+        meta.setdefault(match.lastgroup, match.group(match.lastgroup))
+        if len(meta) == 3:
+            break
 
-    # 检查是否已存在
-    existing_page = syncer.find_page_by_title(title)
-    if existing_page:
-        print(f"📝 更新已存在的页面: {title}")
-        syncer.update_page(existing_page, content)
-        return f"https://notion.so/{existing_page.replace('-', '')}"
+    date = meta.get("date") or datetime.now().strftime("%Y-%m-%d")
+    summary = meta["summary"].strip() if "summary" in meta else None
+    if "tags" in meta and not tags:
+        tags = [t.strip().lstrip('#') for t in meta["tags"].split()]
 
-    return syncer.create_page(title, content, tags, date, summary)
+    return {"title": title, "content": content, "tags": tags, "date": date, "summary": summary}
 
 
 if __name__ == "__main__":
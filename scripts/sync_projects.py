@@ -3,7 +3,7 @@
 同步项目状态到飞书多维表格
 """
 from pathlib import Path
-from sync_feishu import FeishuSync, parse_projects_file, sync_to_feishu
+from sync_feishu import FeishuSync, parse_projects_file, sync_to_feishu_batch
 
 # 项目状态文件路径
 PROJECTS_FILE = Path(__file__).parent.parent.parent / "项目状态.md"
@@ -35,14 +35,11 @@ def main():
     projects = parse_projects_file(PROJECTS_FILE)
     print(f"   📁 发现 {len(projects)} 个项目")
 
-    # 同步每个项目
-    success_count = 0
-    for project in projects:
-        if sync_to_feishu(syncer, "project", project):
-            print(f"   ✓ {project['项目名']}")
-            success_count += 1
-        else:
-            print(f"   ✗ {project['项目名']}")
+    # 批量同步所有项目（新增/更新各合并为一次批量请求）
+    results = sync_to_feishu_batch(syncer, "project", projects)
+    for project, ok in zip(projects, results):
+        print(f"   {'✓' if ok else '✗'} {project['项目名']}")
+    success_count = sum(results)
 
     print(f"\n✅ 同步完成: {success_count}/{len(projects)} 个项目")
     print("   打开飞书多维表格即可查看")